@@ -1,21 +1,39 @@
 import os
+import re
 import time
+import hashlib
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from openai import OpenAI
+import httpx
 from dotenv import load_dotenv
 import telebot
-from celery import Celery, chain
-import requests
+from celery import Celery, chain, chord
+from celery.signals import worker_process_init
 from requests.exceptions import RequestException
 import humanize
 import pytz
 from datetime import datetime
 import arxiv
-from pyzotero import zotero
-import requests
-import json
-import hashlib
 import logging  # Import the logging module
+from result_codec import register_result_codec, SERIALIZER_NAME as RESULT_SERIALIZER
+from http_session import get_session, per_process
+from pdf_download import download_pdf, is_pdf, DownloadError
+from pdf_text import extract_text, chunk_text
+from embeddings import create_embedder
+from vector_index import VectorIndex
+from paper_catalog import PaperCatalog, format_paper_info, STATE_DOWNLOADED, STATE_FAILED
+from zotero_client import ZoteroClient, WriteTokenUsedError
+from zotero_sync import ZoteroMirror
+from update_pipeline import UpdatePipeline, poll_updates
+from webhook_server import serve_webhook
+from conversation_store import create_conversation_store
+from message_editor import ThrottledMessage, MAX_MESSAGE_LENGTH
+from completion_cache import create_completion_cache, cache_key, is_cacheable
+from fair_scheduler import FairScheduler
+from context_window import count_tokens, new_turn, turn_tokens, pack_history, history_messages, history_budget
 
 load_dotenv()
 
@@ -37,18 +55,60 @@ logger.addHandler(handler)
 #print(f"ZOTERO_API_KEY: {os.getenv('ZOTERO_API_KEY')}")
 #print(f"TIMEZONE: {os.getenv('TIMEZONE')}")
 
-# Initialize Zotero client
-try:
-    zot = zotero.Zotero(
-        library_id=os.getenv('ZOTERO_LIBRARY_ID'),
+@per_process
+def get_zotero_client():
+    """
+    ZoteroClient of the current process, sharing the pooled HTTP session
+    """
+    return ZoteroClient(
+        api_key=os.getenv('ZOTERO_API_KEY'),
         library_type='user',
-        api_key=os.getenv('ZOTERO_API_KEY')
+        library_id=os.getenv('ZOTERO_LIBRARY_ID')
     )
-    logger.info("Successfully initialized Zotero client")
-except Exception as e:
-    logger.error(f"Error initializing Zotero client: {str(e)}")
 
-app = Celery('chatbot', broker=os.getenv('CELERY_BROKER_URL'))
+app = Celery('chatbot', broker=os.getenv('CELERY_BROKER_URL'), backend=os.getenv('CELERY_RESULT_BACKEND'))
+
+# Results are only read for a short time (history, chords): expire them to keep redis small,
+# serialize compactly and compress the large ones. Tasks nobody reads the result of use ignore_result.
+register_result_codec(threshold=int(os.getenv('CELERY_RESULT_COMPRESS_THRESHOLD', '1024')))
+CELERY_RESULT_EXPIRES = int(os.getenv('CELERY_RESULT_EXPIRES', '3600'))
+app.conf.update(
+    result_expires=CELERY_RESULT_EXPIRES,
+    task_serializer='msgpack',
+    result_serializer=RESULT_SERIALIZER,
+    accept_content=['msgpack', 'json'],
+    result_accept_content=[RESULT_SERIALIZER, 'msgpack', 'json'],
+)
+
+# Separate queues per task class so bulk downloads never hold up chat replies:
+#   chat         - interactive completions and reply delivery
+#   images       - DALL-E generation
+#   bulk         - arXiv downloads and Zotero uploads
+#   housekeeping - summaries, /ask, usage reports, health checks (and anything unrouted)
+app.conf.task_default_queue = 'housekeeping'
+app.conf.task_routes = {
+    'chatbot.generate_response_chat': {'queue': 'chat'},
+    'chatbot.stream_response_chat': {'queue': 'chat'},
+    'chatbot.send_reply': {'queue': 'chat'},
+    'chatbot.send_failure_reply': {'queue': 'chat'},
+    # embeds the question, which is CPU bound with the local embedder: keep it off gevent
+    'chatbot.ask_library': {'queue': 'housekeeping'},
+    'chatbot.generate_image': {'queue': 'images'},
+    'chatbot.send_image_reply': {'queue': 'images'},
+    'chatbot.download_arxiv_papers': {'queue': 'bulk'},
+    'chatbot.index_paper_text': {'queue': 'bulk'},
+    'chatbot.index_library': {'queue': 'bulk'},
+    'chatbot.ingest_papers_zotero': {'queue': 'bulk'},
+    'chatbot.create_zotero_item': {'queue': 'bulk'},
+    'chatbot.attach_zotero_pdf': {'queue': 'bulk'},
+    'chatbot.report_zotero_ingestion': {'queue': 'bulk'},
+}
+# long running tasks: a worker only reserves the task it is about to run
+app.conf.worker_prefetch_multiplier = int(os.getenv('CELERY_PREFETCH_MULTIPLIER', '1'))
+# message priorities within a queue (redis transport: one list per priority, 0 is served first)
+app.conf.broker_transport_options = {
+    'priority_steps': list(range(10)),
+}
 
 bandwagon_url = os.getenv('BANDWAGON_URL')
 bandwagon_params = {
@@ -75,14 +135,93 @@ pdf_path = Path(os.getenv('PDF_PATH', ''))
 if is_running_in_docker():
     pdf_path = Path('/pdf') # for docker use
 
+# SQLite catalog of the downloaded papers, next to the PDFs by default
+PAPER_CATALOG_PATH = os.getenv('PAPER_CATALOG_PATH') or str(pdf_path / 'papers.sqlite3')
+
+@per_process
+def get_catalog():
+    """
+    Paper catalog of the current process, importing the legacy _info.txt files on first use
+    """
+    catalog = PaperCatalog(PAPER_CATALOG_PATH)
+    catalog.migrate_sidecars(pdf_path)
+    return catalog
+
+# local copy of the Zotero library, refreshed by celery beat every ZOTERO_SYNC_INTERVAL seconds
+ZOTERO_MIRROR_PATH = os.getenv('ZOTERO_MIRROR_PATH') or str(pdf_path / 'zotero_mirror.sqlite3')
+ZOTERO_SYNC_INTERVAL = float(os.getenv('ZOTERO_SYNC_INTERVAL', '900'))
+
+@per_process
+def get_zotero_mirror():
+    """
+    Zotero library mirror of the current process
+    """
+    return ZoteroMirror(ZOTERO_MIRROR_PATH)
+
+# papers downloaded by /paper are added to Zotero, in this collection if set
+ZOTERO_COLLECTION = os.getenv('ZOTERO_COLLECTION') or None
+# retries of a failed ingestion step, waiting ZOTERO_RETRY_DELAY seconds doubled every time
+ZOTERO_MAX_RETRIES = int(os.getenv('ZOTERO_MAX_RETRIES', '5'))
+ZOTERO_RETRY_DELAY = float(os.getenv('ZOTERO_RETRY_DELAY', '10'))
+
+app.conf.beat_schedule = {
+    'sync-zotero-library': {
+        'task': 'chatbot.sync_zotero_library',
+        'schedule': ZOTERO_SYNC_INTERVAL,
+    },
+}
+
+# vectors of the paper chunks searched by /ask, next to the PDFs by default
+VECTOR_INDEX_PATH = os.getenv('VECTOR_INDEX_PATH') or str(pdf_path / 'vectors')
+# words per chunk of a paper, and words shared by consecutive chunks
+CHUNK_WORDS = int(os.getenv('CHUNK_WORDS', '200'))
+CHUNK_OVERLAP_WORDS = int(os.getenv('CHUNK_OVERLAP_WORDS', '40'))
+# chunks retrieved for an /ask question and the prompt tokens they may use
+ASK_TOP_K = int(os.getenv('ASK_TOP_K', '8'))
+ASK_CONTEXT_TOKENS = int(os.getenv('ASK_CONTEXT_TOKENS', '2000'))
+# /summarize: words per chunk summarized in parallel, and tokens of the final summary
+PAPER_SUMMARY_CHUNK_WORDS = int(os.getenv('PAPER_SUMMARY_CHUNK_WORDS', '1500'))
+PAPER_SUMMARY_MAX_TOKENS = int(os.getenv('PAPER_SUMMARY_MAX_TOKENS', '600'))
+
+@per_process
+def get_embedder():
+    """
+    Embedder of the current process selected by EMBEDDER, a local model is loaded only once
+    """
+    return create_embedder(get_openai_client)
+
+@per_process
+def get_vector_index():
+    """
+    Vector index of the paper chunks, memory-mapped once per process
+    """
+    embedder = get_embedder()
+    return VectorIndex(VECTOR_INDEX_PATH, embedder.name, embedder.dim)
+
 openapi_key = os.getenv('OPEN_API_KEY')
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 
-bot = telebot.TeleBot(TELEGRAM_BOT_TOKEN)
-client = OpenAI(api_key=openapi_key)
+# handlers run on the update pipeline's executor, not telebot's own worker threads
+bot = telebot.TeleBot(TELEGRAM_BOT_TOKEN, threaded=False)
+# OpenAI http client limits, each process gets its own connection pool
+OPENAI_POOL_SIZE = int(os.getenv('OPENAI_POOL_SIZE', '10'))
+OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', '60'))
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', '2'))
+
+@per_process
+def get_openai_client():
+    """
+    OpenAI client of the current process. Created after the fork, so prefork
+    workers never share the parent's httpx connections.
+    """
+    http_client = httpx.Client(
+        limits=httpx.Limits(max_connections=OPENAI_POOL_SIZE, max_keepalive_connections=OPENAI_POOL_SIZE),
+        timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=10.0)
+    )
+    return OpenAI(api_key=openapi_key, max_retries=OPENAI_MAX_RETRIES, http_client=http_client)
 
-# Store the last 10 conversations for each user
-conversations = {}
+# Store the recent conversation turns of each user, see CONVERSATION_STORE for shared storage
+conversations = create_conversation_store()
 # dict to store chat model parameters
 chat_params = {
     'model': 'gpt-3.5-turbo',
@@ -92,58 +231,245 @@ chat_params = {
     'frequency_penalty': 0,
     'presence_penalty': 0     
 }
+# opening message of every chat completion
+chat_preamble = [
+    {
+        "role": "user",
+        "content": "You are an AI named Javis and you are in a conversation with a human. You can answer questions, "
+        "provide information as accurate as possible, and help with a wide variety of tasks." 
+    },
+]
+# context window of the chat model and the share of it spent on history
+CHAT_CONTEXT_TOKENS = int(os.getenv('CHAT_CONTEXT_TOKENS', '16385'))
+CHAT_HISTORY_TOKENS = int(os.getenv('CHAT_HISTORY_TOKENS', '3000'))
+# turns pushed out of the history are summarized once they add up to this many tokens
+SUMMARY_BATCH_TOKENS = int(os.getenv('SUMMARY_BATCH_TOKENS', '1000'))
+SUMMARY_MAX_TOKENS = int(os.getenv('SUMMARY_MAX_TOKENS', '300'))
+# stream replies into a message edited as the completion arrives
+CHAT_STREAMING = os.getenv('CHAT_STREAMING', 'false').lower() in ('1', 'true', 'yes')
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', '1.0'))
+
+# per-user rate limit, priorities and queue position of chat requests
+CHAT_RATE_PER_MINUTE = float(os.getenv('CHAT_RATE_PER_MINUTE', '10'))
+CHAT_BURST = int(os.getenv('CHAT_BURST', '5'))
+CHAT_SATURATION_DEPTH = int(os.getenv('CHAT_SATURATION_DEPTH', '20'))
+CHAT_SHORT_PROMPT_TOKENS = int(os.getenv('CHAT_SHORT_PROMPT_TOKENS', '500'))
+
+def chat_queue_depth():
+    """
+    Number of messages waiting in the chat queue, over all priorities
+    """
+    with app.connection_for_read() as connection:
+        channel = connection.default_channel
+        # Channel._size is private kombu API (checked against kombu 5.3.5, see requirements.txt):
+        # on the redis transport it sums the LLEN of every priority list, a missing list is empty
+        size = getattr(channel, '_size', None)
+        if size is not None:
+            try:
+                return size('chat')
+            except Exception as e:
+                logger.warning(f"chat queue size unavailable, falling back to a passive declare: {e}")
+        try:
+            return channel.queue_declare(queue='chat', passive=True).message_count
+        except connection.channel_errors as e:
+            # the queue doesn't exist until the first message is sent to it
+            if getattr(e, 'code', None) == 404 or 'NOT_FOUND' in str(e):
+                return 0
+            raise
+
+scheduler = FairScheduler(chat_queue_depth, rate_per_minute=CHAT_RATE_PER_MINUTE, burst=CHAT_BURST,
+                          saturation_depth=CHAT_SATURATION_DEPTH, short_prompt_tokens=CHAT_SHORT_PROMPT_TOKENS)
+
+# opt-in cache of chat completions, see COMPLETION_CACHE
+completion_cache = create_completion_cache()
 
 
 SYSTEM_PROMPT = os.getenv('SYSTEM_PROMPT')
 
+# update pipeline limits: updates queued or running at once, handler threads
+BOT_MAX_IN_FLIGHT = int(os.getenv('BOT_MAX_IN_FLIGHT', '64'))
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', '16'))
+
+# 'polling' (default) or 'webhook'
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # public url registered with telegram, unset to skip registration
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')  # required in webhook mode
+
 
 
-def conversation_tracking(text_message, user_id):
+def conversation_tracking(text_message, user_id, reply_to_message_id=None):
     """
-    Make remember all the conversation
+    Make remember all the conversation and dispatch the reply
     :param user_id: telegram user id
     :param text_message: text message
-    :return: str
+    :param reply_to_message_id: message the reply should be attached to
+    :return: AsyncResult of the chat completion task
     """
-    # Get the last 10 conversations and responses for this user
-    user_conversations = conversations.get(user_id, {'conversations': [], 'responses': []})
-    user_messages = user_conversations['conversations'][-9:] + [text_message]
-    user_responses = user_conversations['responses'][-9:]
-
-    # Store the updated conversations and responses for this user
-    conversations[user_id] = {'conversations': user_messages, 'responses': user_responses}
-
-    # Construct the full conversation history in the user:assistant, " format
-    conversation_history = []
-
-    for i in range(min(len(user_messages), len(user_responses))):
-        conversation_history.append({
-            "role": "user", "content": user_messages[i]
-        })
-        conversation_history.append({
-            "role": "assistant", "content": user_responses[i]
-        })
-
-    # Add last prompt
-    conversation_history.append({
-        "role": "user", "content": text_message
-    })
+    model = chat_params['model']
+    record = conversations.get(user_id) or {}
+    replies = conversations.get_replies(user_id)
+    turns = resolve_turns(record.get('turns', []), model, replies)
+    summary = resolve_summary(record, model)
+    turn = new_turn(text_message, model)
+
+    # Keep the newest turns that fit the budget, leaving room for the summary and the reply
+    preamble_tokens = sum(count_tokens(message['content'], model) for message in chat_preamble)
+    budget = history_budget(CHAT_CONTEXT_TOKENS, chat_params['max_tokens'],
+                            preamble_tokens + record.get('summary_tokens', 0) + turn['user_tokens'],
+                            CHAT_HISTORY_TOKENS)
+    start = pack_history(turns, budget)
+    record.setdefault('unsummarized', []).extend(t for t in turns[:start] if turn_tokens(t) is not None)
+    turns = turns[start:]
+
+    # Construct the conversation history in the user:assistant, " format and add last prompt
+    conversation_history = history_messages(turns) + [{"role": "user", "content": text_message}]
+
+    # Short single-turn prompts are served before long conversations
+    prompt_tokens = (sum(turn_tokens(t) or 0 for t in turns) + record.get('summary_tokens', 0)
+                     + turn['user_tokens'])
+    priority = scheduler.priority(prompt_tokens, multi_turn=len(conversation_history) > 1 or bool(summary))
+
+    # The worker delivers the reply itself and writes it back to the history
+    on_error = send_failure_reply.s(user_id, reply_to_message_id, "Could not generate a reply, try again later.")
+    if CHAT_STREAMING:
+        completion = stream_response_chat.signature(
+            (conversation_history, summary, user_id, reply_to_message_id), priority=priority)
+        completion_id = completion.freeze().id
+        request = completion
+    else:
+        completion = generate_response_chat.s(conversation_history, summary).set(priority=priority)
+        completion_id = completion.freeze().id
+        request = chain(completion, send_reply.s(user_id, reply_to_message_id, completion_id))
+
+    # Remember the pending completion until the worker records the reply
+    turn['response'] = {'task_id': completion_id, 'created_at': time.time()}
+    turns.append(turn)
+    record['turns'] = turns
+
+    # Fold the turns that dropped out of the history into the running summary
+    if (not record.get('summary_task') and
+            sum(turn_tokens(t) for t in record['unsummarized']) >= SUMMARY_BATCH_TOKENS):
+        task = summarize_conversation.delay(summary, history_messages(record['unsummarized']))
+        record['summary_task'] = task.id
+        record['summary_started_at'] = time.time()
+        record['summarizing'] = record['unsummarized']
+        record['unsummarized'] = []
+
+    # Store the updated conversation before the reply can arrive, then drop the merged replies
+    conversations.set(user_id, record)
+    conversations.delete_replies(user_id, replies)
+
     # Generate response
-    task = generate_response_chat.apply_async(args=[conversation_history])
-    response = task.get()
+    return request.apply_async(link_error=on_error)
+
 
-    # Add the response to the user's responses
-    user_responses.append(response)
+def resolve_summary(record, model):
+    """
+    Take over the running summary once its summarization task has finished.
+    Never blocks; if the task failed, or its result expired before it was read, its turns
+    are queued for the next summarization.
+    :param record: conversation record of the user, updated in place
+    :param model: model the token counts are made for
+    :return: str or None, the current summary
+    """
+    task_id = record.get('summary_task')
+    if task_id:
+        result = app.AsyncResult(task_id)
+        # a result read as pending after it expired will never arrive
+        expired = time.time() - record.get('summary_started_at', 0) > CELERY_RESULT_EXPIRES
+        if result.successful():
+            record['summary'] = result.result
+            record['summary_tokens'] = count_tokens(result.result, model)
+        elif result.failed() or expired:
+            record['unsummarized'] = record.get('summarizing', []) + record.get('unsummarized', [])
+        if result.ready() or expired:
+            record['summary_task'] = None
+            record['summarizing'] = []
+    return record.get('summary')
+
+
+def resolve_turns(turns, model, replies):
+    """
+    Fill in the responses of turns whose completion has finished, from the replies the
+    worker recorded (see record_reply) or else from the task result.
+    Never blocks: completions still in flight are left pending. Failed turns and turns
+    still pending once their result expired from the backend are dropped.
+    :param turns: conversation turns, see context_window.new_turn
+    :param model: model the token counts are made for
+    :param replies: dict of completion task id to reply, from the conversation store
+    :return: list
+    """
+    resolved = []
+    for turn in turns:
+        if isinstance(turn['response'], dict):
+            task_id = turn['response']['task_id']
+            result = app.AsyncResult(task_id)
+            if task_id in replies:
+                turn['response'] = replies[task_id]
+                turn['response_tokens'] = count_tokens(replies[task_id], model)
+            elif result.successful():
+                turn['response'] = result.result
+                turn['response_tokens'] = count_tokens(result.result, model)
+            elif result.failed() or time.time() - turn['response'].get('created_at', 0) > CELERY_RESULT_EXPIRES:
+                turn['response'] = None
+        if turn['response'] is not None:
+            resolved.append(turn)
+    return resolved
+
+
+def record_reply(user_id, task_id, text):
+    """
+    Keep the reply of a completion in the conversation store, so the history doesn't
+    depend on the task result, which expires after CELERY_RESULT_EXPIRES. The bot merges
+    it into the record on the next message; the worker never writes the record itself,
+    so it can't overwrite a turn the bot is storing at the same time.
+    Only reaches the bot if the worker shares the conversation store (CONVERSATION_STORE=redis);
+    otherwise resolve_turns reads the result instead.
+    :param user_id: telegram user id
+    :param task_id: id of the completion task of the turn
+    :param text: the reply
+    """
+    conversations.add_reply(user_id, task_id, text)
 
-    # Store the updated conversations and responses for this user
-    conversations[user_id] = {'conversations': user_messages, 'responses': user_responses}
 
-    return response
+@app.task(ignore_result=True)
+def send_reply(text, chat_id, reply_to_message_id=None, completion_id=None):
+    """
+    task: deliver a text reply to the telegram chat
 
+    Args:
+        text (str): message to send
+        chat_id (int): telegram chat id
+        reply_to_message_id (int, optional): message to reply to
+        completion_id (str, optional): chat completion task of the reply, to record it in the history
+    """
+    bot.send_message(chat_id, text, reply_to_message_id=reply_to_message_id)
+    if completion_id:
+        record_reply(chat_id, completion_id, text)
+    return text
 
-@app.task
+
+@app.task(ignore_result=True)
+def send_failure_reply(request, exc, traceback, chat_id, reply_to_message_id=None, text=None):
+    """
+    errback: tell the user their request failed instead of leaving them waiting
+
+    Args:
+        chat_id (int): telegram chat id
+        reply_to_message_id (int, optional): message to reply to
+        text (str, optional): message to send
+    """
+    logger.error(f"Task {request.id} failed: {exc}")
+    bot.send_message(chat_id, text or "Something went wrong, try again later.",
+                     reply_to_message_id=reply_to_message_id)
+
+
+@app.task(ignore_result=True)
 def generate_image(prompt, number=1):
-    response = client.images.generate(
+    response = get_openai_client().images.generate(
         prompt=prompt,
         n=number,
         model = "dall-e-3",
@@ -167,34 +493,142 @@ def handle_image(message):
     logger.info(f"message= {message.text}")
     logger.info(f"prompt = {prompt}")
     numbers = 1 # Dall-E-3 api only support number = 1
-    task = generate_image.apply_async(args=[prompt, numbers])
-    image_url = task.get()
+    chain(
+        generate_image.s(prompt, numbers),
+        send_image_reply.s(message.chat.id, message.message_id, prompt)
+    ).apply_async(link_error=send_failure_reply.s(message.chat.id, message.message_id,
+                                                  "Could not generate image, try again later."))
+
+
+@app.task(ignore_result=True)
+def send_image_reply(image_url, chat_id, reply_to_message_id, caption):
+    """
+    task: deliver a generated image to the telegram chat
+
+    Args:
+        image_url (str): url of the generated image
+        chat_id (int): telegram chat id
+        reply_to_message_id (int): message to reply to
+        caption (str): caption of the photo
+    """
     if image_url is not None:
-        logger.info(f"chat_id= {message.chat.id} \nphoto = {image_url}\n " +
+        logger.info(f"chat_id= {chat_id} \nphoto = {image_url}\n " +
                 f"caption = {caption}")
-        bot.send_photo(chat_id=message.chat.id, photo=image_url, reply_to_message_id=message.message_id,
-                        caption=prompt, parse_mode='Markdown')
+        bot.send_photo(chat_id=chat_id, photo=image_url, reply_to_message_id=reply_to_message_id,
+                        caption=caption, parse_mode='Markdown')
     else:
-        bot.reply_to(message, "Could not generate image, try again later.")
+        bot.send_message(chat_id, "Could not generate image, try again later.",
+                         reply_to_message_id=reply_to_message_id)
+
+
+def build_chat_messages(message_list, summary=None):
+    """
+    Put the preamble and the running summary in front of the conversation
+    :param message_list: conversation history and prompt
+    :param summary: running summary of the earlier conversation, or None
+    :return: list
+    """
+    messages = list(chat_preamble)
+    if summary:
+        messages.append({"role": "system", "content": f"Summary of the earlier conversation: {summary}"})
+    return messages + message_list
+
+def completion_cache_key(messages, message_list, summary=None):
+    """
+    Cache key of a chat completion, None if the cache is off or the request must not be cached
+    :param messages: full message list sent to the model
+    :param message_list: conversation history and prompt
+    :param summary: running summary of the earlier conversation, or None
+    :return: str or None
+    """
+    if completion_cache is None or not is_cacheable(chat_params, message_list, summary):
+        return None
+    return cache_key(chat_params, messages)
+
+@app.task
+def generate_response_chat(message_list, summary=None):
+    messages = build_chat_messages(message_list, summary)
+    key = completion_cache_key(messages, message_list, summary)
+    if key is not None:
+        cached = completion_cache.get(key)
+        if cached is not None:
+            return cached
+
+    completion = get_openai_client().chat.completions.create(
+        messages=messages,
+        **chat_params
+    )
+    response = completion.choices[0].message.content
+    if key is not None:
+        completion_cache.set(key, response)
+    return response
+
+@app.task(bind=True)
+def stream_response_chat(self, message_list, summary, chat_id, reply_to_message_id=None):
+    """
+    task: stream the chat completion into a telegram message edited as tokens arrive
 
+    Args:
+        message_list (list): conversation history and prompt
+        summary (str): running summary of the earlier conversation, or None
+        chat_id (int): telegram chat id
+        reply_to_message_id (int, optional): message to reply to
 
+    Returns:
+        str: the complete reply
+    """
+    messages = build_chat_messages(message_list, summary)
+    key = completion_cache_key(messages, message_list, summary)
+    reply = ThrottledMessage(bot, chat_id, reply_to_message_id, interval=STREAM_EDIT_INTERVAL)
+    if key is not None:
+        cached = completion_cache.get(key)
+        if cached is not None:
+            reply.finish(cached)
+            record_reply(chat_id, self.request.id, cached)
+            return cached
+
+    stream = get_openai_client().chat.completions.create(
+        messages=messages,
+        stream=True,
+        **chat_params
+    )
+    chunks = []
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            chunks.append(chunk.choices[0].delta.content)
+            reply.update(''.join(chunks))
+
+    response = ''.join(chunks)
+    reply.finish(response)
+    record_reply(chat_id, self.request.id, response)
+    if key is not None:
+        completion_cache.set(key, response)
+    return response
 
 @app.task
-def generate_response_chat(message_list):
-    completion = client.chat.completions.create(
+def summarize_conversation(summary, message_list):
+    """
+    task: condense conversation turns into the running summary of the conversation
+
+    Args:
+        summary (str): current summary, None for the first one
+        message_list (list): user/assistant messages to fold into the summary
+
+    Returns:
+        str: the updated summary
+    """
+    transcript = '\n'.join(f"{message['role']}: {message['content']}" for message in message_list)
+    instructions = ("Update the summary of a conversation between a user and an AI assistant with the new "
+                    "messages. Keep facts, names, decisions and open questions the assistant may need later. "
+                    "Answer with the updated summary only.")
+    completion = get_openai_client().chat.completions.create(
         messages=[
-            {
-                "role": "user",
-                "content": "You are an AI named Javis and you are in a conversation with a human. You can answer questions, "
-                "provide information as accurate as possible, and help with a wide variety of tasks." 
-            },
-        ] + message_list,
-        model="gpt-3.5-turbo",
-        temperature=0.7,
-        max_tokens=1024,
-        top_p=1,
-        frequency_penalty=0,
-        presence_penalty=0    
+            {"role": "system", "content": instructions},
+            {"role": "user", "content": f"Current summary:\n{summary or '(none)'}\n\nNew messages:\n{transcript}"},
+        ],
+        model=chat_params['model'],
+        temperature=0,
+        max_tokens=SUMMARY_MAX_TOKENS
     )
     return completion.choices[0].message.content
 
@@ -255,7 +689,7 @@ def call_rest_api_usage(url, params):
         _type_: _description_
     """
     try:
-        with requests.get(url, params=params) as response:
+        with get_session().get(url, params=params) as response:
             if response.status_code == 200:
                 if 'application/json' in response.headers.get('Content-Type'):
                     data = response.json()
@@ -265,53 +699,337 @@ def call_rest_api_usage(url, params):
                 return response.json()
     except RequestException as e:
         logger.error(f"An error occured: {e}")
-        response.close()
+
+@per_process
+def get_arxiv_client():
+    """
+    arXiv API client of the current process, its session and rate limiting are reused across tasks.
+    The client isn't safe for concurrent use, hold arxiv_lock while querying it.
+    """
+    return arxiv.Client()
+
+# serializes arXiv API queries of concurrent tasks (threads or gevent pool), which also
+# keeps the worker within the arXiv rate limit
+arxiv_lock = threading.Lock()
+
+# parallel PDF downloads of one /paper request
+ARXIV_DOWNLOAD_CONCURRENCY = int(os.getenv('ARXIV_DOWNLOAD_CONCURRENCY', '4'))
+# new style (2403.03186v2) and old style (hep-th/9901001) arXiv identifiers
+ARXIV_ID_PATTERN = r'(\d{4}\.\d{4,5}(?:v\d+)?|[a-z\-]+(?:\.[A-Z]{2})?/\d{7}(?:v\d+)?)'
+# hits listed by /search
+SEARCH_RESULTS = int(os.getenv('SEARCH_RESULTS', '5'))
+
+def pdf_filename(paperID):
+    """
+    Name of the downloaded pdf of a paper. The '/' of old style IDs (hep-th/9901001)
+    becomes '_', so every pdf is directly in the download directory.
+    :param paperID: arXiv ID
+    :return: str
+    """
+    return f"{paperID.replace('/', '_')}.pdf"
+
+def save_arxiv_paper(paper, paperID, dir_path):
+    """
+    Record an arXiv paper in the catalog and download its pdf
+    :param paper: arxiv.Result
+    :param paperID: arXiv ID the files are named after
+    :param dir_path: Path of the download directory
+    :return: tuple (str, dict), the paper info and the download stats (None if the pdf was already there)
+    """
+    filename = dir_path / pdf_filename(paperID)
+    catalog = get_catalog()
+    catalog.save_metadata(paperID, paper.title, [str(author) for author in paper.authors],
+                          paper.pdf_url, paper.summary)
+    info_str = format_paper_info(catalog.get(paperID))
+    logger.info(info_str)
+
+    # a pdf is only ever renamed into place once complete, so an existing one is intact
+    stats = None
+    if not is_pdf(filename):
+        try:
+            stats = download_pdf(paper.pdf_url, filename)
+        except DownloadError:
+            catalog.set_state(paperID, STATE_FAILED)
+            raise
+    catalog.set_state(paperID, STATE_DOWNLOADED, str(filename))
+    if needs_indexing(catalog.get(paperID)):
+        index_paper_text.delay(paperID)
+    return info_str, stats
+
+def format_download_stats(stats):
+    """
+    Size and throughput of a download for progress messages
+    :param stats: dict returned by download_pdf, or None
+    :return: str
+    """
+    if stats is None:
+        return 'already downloaded'
+    return f"{stats['bytes'] / 1e6:.1f} MB, {stats['bytes_per_second'] / 1e6:.1f} MB/s"
+
+def resolve_arxiv_ids(sources):
+    """
+    Collect arXiv IDs from IDs, abs/pdf links and listing pages (e.g. https://arxiv.org/list/cs.CL/new)
+    :param sources: list of str
+    :return: list of unique IDs in the order given
+    """
+    ids = []
+    for source in sources:
+        if source.startswith('http') and not re.search(r'/(abs|pdf)/', source):
+            response = get_session().get(source)
+            response.raise_for_status()
+            found = re.findall(r'/abs/' + ARXIV_ID_PATTERN, response.text)
+        else:
+            found = re.findall(ARXIV_ID_PATTERN, source)[:1]
+        for paperID in found:
+            if paperID not in ids:
+                ids.append(paperID)
+    return ids
 
 @app.task
-def call_download_arxiv_pdf(paperID, dir):
-    """_summary_
-    task: download the pdf of the arXiv paper
+def download_arxiv_papers(sources, dir, chat_id, reply_to_message_id=None):
+    """
+    task: download many arXiv papers with one metadata query and concurrent pdf downloads,
+    reporting the progress in a single telegram message
 
     Args:
-        paperID (str): e.g. 2403.03186
-        dir (str): path or Path object for the directory
+        sources (list): arXiv IDs, abs/pdf links or listing page urls
+        dir (str): path of the download directory
+        chat_id (int): telegram chat id
+        reply_to_message_id (int, optional): message to reply to
+
+    Returns:
+        list: IDs of the papers downloaded, for the next step of the ingestion chain
     """
+    progress = ThrottledMessage(bot, chat_id, reply_to_message_id, placeholder='Looking up papers…',
+                                interval=STREAM_EDIT_INTERVAL)
     try:
-        dir_path = Path(dir)
-        logger.info(f'Paper ID: {paperID} \n Directory: {dir_path}')
-        paper = next(arxiv.Client().results(arxiv.Search(id_list=[paperID])))
-        #print(f"Summary: {paper.summary}")
-        filename = dir_path / f"{paperID}.pdf"
-
-        # generate summary file
-        summary_file = dir_path / f"{paperID}_info.txt"
-        info_str = ''
-        # skip if the file already exists
-        if not summary_file.exists():
-            with open(summary_file, 'w', encoding='utf-8') as file:
-                info_str += 'title, ' + paper.title + '\n'
-                info_str += 'url, ' + paper.pdf_url + '\n'
-                # Join authors with commas and add trailing newline
-                authors = ', '.join(str(author) for author in paper.authors)
-                info_str += 'author, ' + authors + '\n'
-                info_str += 'summary, ' + paper.summary
-                logger.info(info_str)
-                file.write(info_str)
-
-        # start download pdf
-        paper.download_pdf(filename=str(filename))
-        return f"Paper downloaded: {filename} \n {info_str}"
-
+        ids = resolve_arxiv_ids(sources)
+    except RequestException as e:
+        progress.finish(f"Could not read the paper list: {e}")
+        return []
+    if not ids:
+        progress.finish('No arXiv IDs found, usage: /paper {paperID} ... (e.g. 2403.03186)')
+        return []
+
+    dir_path = Path(dir)
+    logger.info(f"Downloading {len(ids)} arXiv papers to {dir_path}")
+    papers = {}
+    try:
+        with arxiv_lock:
+            for paper in get_arxiv_client().results(arxiv.Search(id_list=ids, max_results=len(ids))):
+                short_id = paper.get_short_id()
+                papers[short_id] = papers[re.sub(r'v\d+$', '', short_id)] = paper
     except Exception as e:
-        result = f"Error downloading arXiv PDF: {e}"
-        logger.error(result)
-        return result
+        logger.error(f"Error looking up arXiv papers {ids}: {e}")
+        progress.finish(f"Could not look up the papers on arXiv: {e}")
+        return []
+
+    status = {paperID: 'not found on arXiv' for paperID in ids if paperID not in papers}
+    infos = {}
+
+    def render():
+        # the whole status is rendered every time, so it must fit one message
+        failed = [paperID for paperID in ids if paperID in status and not status[paperID].startswith('✓')]
+        header = f"Downloaded {sum(1 for s in status.values() if s.startswith('✓'))}/{len(ids)} papers"
+        if failed:
+            header += f", {len(failed)} failed"
+        text = '\n'.join([header] + [f"{paperID}: {status.get(paperID, '…')}" for paperID in ids])
+        if len(text) > MAX_MESSAGE_LENGTH:
+            # too many papers to list them all: only the failures
+            text = '\n'.join([header] + [f"{paperID}: {status[paperID]}" for paperID in failed])
+        if len(text) > MAX_MESSAGE_LENGTH:
+            text = text[:text.rindex('\n', 0, MAX_MESSAGE_LENGTH - 2)] + '\n…'
+        return text
+
+    progress.update(render())
+    with ThreadPoolExecutor(max_workers=ARXIV_DOWNLOAD_CONCURRENCY) as pool:
+        futures = {pool.submit(save_arxiv_paper, papers[paperID], paperID, dir_path): paperID
+                   for paperID in ids if paperID in papers}
+        for future in as_completed(futures):
+            paperID = futures[future]
+            try:
+                infos[paperID], stats = future.result()
+                status[paperID] = f"✓ {papers[paperID].title} ({format_download_stats(stats)})"
+            except Exception as e:
+                logger.error(f"Error downloading arXiv PDF {paperID}: {e}")
+                status[paperID] = f"✗ {e}"
+            progress.update(render())
+
+    if len(ids) == 1 and ids[0] in infos:
+        progress.finish(f"Paper downloaded: {dir_path / pdf_filename(ids[0])} \n {infos[ids[0]]}")
+    else:
+        progress.finish(render())
+    return [paperID for paperID in ids if paperID in infos]
+
+@app.task(ignore_result=True)
+def index_paper_text(paperID):
+    """
+    task: add the text of a downloaded paper to the full text search index and its
+    chunks to the vector index
+
+    Args:
+        paperID (str): arXiv ID of a downloaded paper
+    """
+    catalog = get_catalog()
+    paper = catalog.get(paperID)
+    if paper is None or not paper['pdf_file']:
+        logger.error(f"Can't index {paperID}: not downloaded")
+        return
+    start = time.monotonic()
+    text = extract_text(Path(paper['pdf_file']))
+    if paper['indexed_at'] is None:
+        catalog.index_text(paperID, text)
+
+    index = get_vector_index()
+    if not index.has_paper(paperID):
+        chunks = chunk_text(f"{paper['title']}\n\n{text}", CHUNK_WORDS, CHUNK_OVERLAP_WORDS)
+        index.add_paper(paperID, chunks, get_embedder().embed(chunks))
+    logger.info(f"Indexed {paperID}: {len(text)} characters in {time.monotonic() - start:.1f}s")
+
+def needs_indexing(paper):
+    """
+    Check whether a downloaded paper is missing from the full text or the vector index
+    :param paper: paper as returned by the catalog
+    :return: bool
+    """
+    return paper['indexed_at'] is None or not get_vector_index().has_paper(paper['arxiv_id'])
+
+@app.task(ignore_result=True)
+def index_library():
+    """
+    task: queue indexing of every downloaded paper missing from the search or vector
+    index, e.g. the papers downloaded before the indexes existed
+    """
+    paper_ids = [paper['arxiv_id'] for paper in get_catalog().downloaded() if needs_indexing(paper)]
+    for paperID in paper_ids:
+        index_paper_text.delay(paperID)
+    logger.info(f"Queued {len(paper_ids)} papers for indexing")
+
+@app.task
+def ask_library(question):
+    """
+    task: answer a question from the most relevant passages of the downloaded papers
+
+    Args:
+        question (str): the user's question
+
+    Returns:
+        str: the answer followed by the arXiv IDs of the papers it is based on
+    """
+    model = chat_params['model']
+    passages = get_vector_index().search(get_embedder().embed([question])[0], k=ASK_TOP_K)
+    if not passages:
+        return "No papers are indexed yet, download some with /paper first."
+
+    excerpts, sources, tokens = [], [], 0
+    for passage in passages:
+        passage_tokens = count_tokens(passage['text'], model)
+        if excerpts and tokens + passage_tokens > ASK_CONTEXT_TOKENS:
+            break
+        excerpts.append(f"[{passage['arxiv_id']}] {passage['text']}")
+        tokens += passage_tokens
+        if passage['arxiv_id'] not in sources:
+            sources.append(passage['arxiv_id'])
+
+    messages = list(chat_preamble) + [
+        {"role": "system", "content": "Answer the question using these excerpts of papers from the user's "
+                                      "library, citing their arXiv IDs in brackets. If the excerpts don't "
+                                      "answer it, say so.\n\n" + '\n\n'.join(excerpts)},
+        {"role": "user", "content": question},
+    ]
+    completion = get_openai_client().chat.completions.create(messages=messages, **chat_params)
+    return f"{completion.choices[0].message.content}\n\nSources: {', '.join(sources)}"
+
+
+@app.task(bind=True)
+def summarize_paper(self, paperID):
+    """
+    task: summarize a downloaded paper with map-reduce, replacing itself with a chord
+    of summarize_paper_chunk tasks followed by reduce_paper_summaries. The result is
+    cached in the catalog.
+
+    Args:
+        paperID (str): arXiv ID of a downloaded paper
+
+    Returns:
+        str: the summary, when it was cached already
+    """
+    catalog = get_catalog()
+    paper = catalog.get(paperID)
+    if paper['generated_summary']:
+        return paper['generated_summary']
+
+    text = catalog.text(paperID) or extract_text(Path(paper['pdf_file']))
+    chunks = chunk_text(text, PAPER_SUMMARY_CHUNK_WORDS, 0)
+    if not chunks:
+        return f"No text could be extracted from {paperID}."
+    logger.info(f"Summarizing {paperID} in {len(chunks)} chunks")
+    return self.replace(chord(
+        [summarize_paper_chunk.s(paper['title'], index, len(chunks), chunk) for index, chunk in enumerate(chunks)],
+        reduce_paper_summaries.s(paperID)
+    ))
+
+@app.task
+def summarize_paper_chunk(title, index, count, chunk):
+    """
+    task: summarize one part of a paper
+
+    Args:
+        title (str): paper title
+        index (int): position of the part
+        count (int): number of parts
+        chunk (str): text of the part
+
+    Returns:
+        str: summary of the part
+    """
+    completion = get_openai_client().chat.completions.create(
+        messages=[
+            {"role": "system", "content": "Summarize this part of a research paper in a few sentences. Keep the "
+                                          "methods, results and numbers. Answer with the summary only."},
+            {"role": "user", "content": f"Paper: {title}\nPart {index + 1} of {count}:\n\n{chunk}"},
+        ],
+        model=chat_params['model'],
+        temperature=0,
+        max_tokens=SUMMARY_MAX_TOKENS
+    )
+    return completion.choices[0].message.content
+
+@app.task
+def reduce_paper_summaries(summaries, paperID):
+    """
+    chord callback: combine the summaries of the parts of a paper and cache the result
+
+    Args:
+        summaries (list): part summaries in order
+        paperID (str): arXiv ID of the paper
+
+    Returns:
+        str: the summary of the paper
+    """
+    catalog = get_catalog()
+    paper = catalog.get(paperID)
+    parts = '\n\n'.join(f"Part {index + 1}: {summary}" for index, summary in enumerate(summaries))
+    completion = get_openai_client().chat.completions.create(
+        messages=[
+            {"role": "system", "content": "Combine the summaries of the parts of a research paper into one summary: "
+                                          "the problem, the approach, the main results and limitations. "
+                                          "Answer with the summary only."},
+            {"role": "user", "content": f"Paper: {paper['title']}\n\n{parts}"},
+        ],
+        model=chat_params['model'],
+        temperature=0,
+        max_tokens=PAPER_SUMMARY_MAX_TOKENS
+    )
+    summary = f"{paperID} {paper['title']}\n\n{completion.choices[0].message.content}"
+    catalog.set_generated_summary(paperID, summary)
+    return summary
 
 
 @bot.message_handler(commands=["start", "help"])
 def start(message):
     if message.text.startswith("/help"):
-        bot.reply_to(message, "/image to generate image animation\n/create generate image\n/paper {paperID} - Download arXiv paper and upload to Zotero\n/clear - Clears old "
+        bot.reply_to(message, "/image to generate image animation\n/create generate image\n/paper {paperID} ... - Download arXiv papers (IDs or a listing url) and upload to Zotero\n/search {words} - Search the text of downloaded papers\n/ask {question} - Answer from the downloaded papers\n/summarize {paperID} - Summarize a downloaded paper\n/health - Check the worker's API connections\n/clear - Clears old "
                               "conversations\nsend text to get replay\nsend voice to do voice"
                               "conversation")
     else:
@@ -329,13 +1047,25 @@ def get_vps_data_usage(message):
     retrieve vps data usage
     """
     #print(f"url = {bandwagon_url}", f"params = {bandwagon_params}")
-    bwg_rlt = call_rest_api_usage.delay(bandwagon_url, bandwagon_params) 
+    chord([
+        call_rest_api_usage.s(bandwagon_url, bandwagon_params),
+        call_rest_api_usage.s(jms_url, jms_params)
+    ])(send_vps_data_usage.s(message.chat.id, message.message_id).on_error(
+        send_failure_reply.s(message.chat.id, message.message_id, "Could not read the data usage.")))
+
+@app.task(ignore_result=True)
+def send_vps_data_usage(results, chat_id, reply_to_message_id):
+    """
+    chord callback: format both data usage reports and deliver them
 
-    jms_rlt = call_rest_api_usage.delay(jms_url, jms_params)
-    
-    #print(f"{result.get()}")
-    bot.reply_to(message, get_bandwagon_data_usage(bwg_rlt.get()) + '\n\n' +
-                 get_jms_data_usage(jms_rlt.get()))
+    Args:
+        results (list): [bandwagon data, jms data] returned by call_rest_api_usage
+        chat_id (int): telegram chat id
+        reply_to_message_id (int): message to reply to
+    """
+    bwg_data, jms_data = results
+    send_reply(get_bandwagon_data_usage(bwg_data) + '\n\n' + get_jms_data_usage(jms_data),
+               chat_id, reply_to_message_id)
 
 @bot.message_handler(commands=['paper'])
 def dl_arxiv(message):
@@ -346,261 +1076,357 @@ def dl_arxiv(message):
     """
     reply = ""
     if message.text.startswith("/paper"):
-        paperID = message.text.replace("/paper", "").strip()
-        if len(paperID) == 0:
-            bot.reply_to(message, 'Usage: /paper {paperID} (e.g. 2403.03186)')
-        print(f"paperID = {paperID}")
-        summary_file = pdf_path / f"{paperID}_info.txt"
-
-        info_str = ''
-        # skip if the file already exists
-        if summary_file.exists():
-            print(f"{summary_file} exists")
-            with open(summary_file, 'r', encoding='utf-8') as file:
-                info_str = file.read()
-                print(info_str)
-            reply = info_str
+        sources = re.split(r'[\s,]+', message.text.replace("/paper", "").strip())
+        sources = [source for source in sources if source]
+        if len(sources) == 0:
+            bot.reply_to(message, 'Usage: /paper {paperID} ... (e.g. 2403.03186) or an arXiv listing url')
+            return
+        record = get_catalog().get(sources[0])
+        # skip if the paper was already downloaded completely
+        if (len(sources) == 1 and record and record['state'] == STATE_DOWNLOADED
+                and is_pdf(pdf_path / pdf_filename(sources[0]))):
+            reply = format_paper_info(record)
+            if zotero_configured() and not record['zotero_uploaded_at']:
+                ingest_papers_zotero.delay([record['arxiv_id']], message.chat.id, message.message_id)
         else:
-            logger.info(f"start downloading arXiv PDF: {paperID} {pdf_path}")
-            rlt = call_download_arxiv_pdf.delay(paperID, dir=str(pdf_path))
-            reply = rlt.get()
-        
+            logger.info(f"start downloading arXiv PDFs: {sources} {pdf_path}")
+            download = download_arxiv_papers.si(sources, str(pdf_path), message.chat.id, message.message_id)
+            on_error = send_failure_reply.s(message.chat.id, message.message_id, "Could not download the papers.")
+            if zotero_configured():
+                # download -> Zotero item -> PDF attachment, each step retried on its own
+                chain(download, ingest_papers_zotero.s(message.chat.id, message.message_id)).apply_async(
+                    link_error=on_error)
+            else:
+                download.apply_async(link_error=on_error)
+            return
+
     bot.reply_to(message, reply)
-        
-    # After successful download, try to upload to Zotero
-    # if reply.startswith("Paper downloaded:"):
-    #     upload_result = upload_pdf_zotero.delay(paperID)
-    #     bot.reply_to(message, upload_result.get())
 
-@app.task
-def test_upload_zotero(paper_id):
-    pdf_path = Path("/mnt/books/Books/GPT") / "2311.02883.pdf"
-    response = zot.attachment_simple([str(pdf_path)], "K93PPGZ7")
-    #response = zot.attachment_both([pdffile], "K93PPGZ7")
-    logger.info(response)
+@bot.message_handler(commands=['search'])
+def search_papers(message):
+    """
+    full text search of the downloaded papers, best matches first
+    """
+    query = message.text.replace("/search", "", 1).strip()
+    if not query:
+        bot.reply_to(message, 'Usage: /search {words} (e.g. /search sparse attention)')
+        return
+    start = time.monotonic()
+    hits = get_catalog().search(query, limit=SEARCH_RESULTS)
+    elapsed = (time.monotonic() - start) * 1000
+    if not hits:
+        bot.reply_to(message, f"No papers found for: {query}")
+        return
+    lines = [f"{len(hits)} papers ({elapsed:.0f} ms)"]
+    for hit in hits:
+        lines.append(f"\n{hit['arxiv_id']} {hit['title']}\n{hit['snippet']}")
+    bot.reply_to(message, '\n'.join(lines)[:MAX_MESSAGE_LENGTH])
+
+@bot.message_handler(commands=['ask'])
+def ask_papers(message):
+    """
+    answer a question from the downloaded papers
+    """
+    question = message.text.replace("/ask", "", 1).strip()
+    if not question:
+        bot.reply_to(message, 'Usage: /ask {question} (e.g. /ask how does sparse attention scale?)')
+        return
+    if not scheduler.admit(message.chat.id):
+        bot.reply_to(message, "You're sending messages too fast, please wait a moment and try again.")
+        return
+    chain(
+        ask_library.s(question),
+        send_reply.s(message.chat.id, message.message_id)
+    ).apply_async(link_error=send_failure_reply.s(message.chat.id, message.message_id))
+
+@bot.message_handler(commands=['summarize'])
+def summarize_paper_command(message):
+    """
+    summarize a downloaded paper, answered from the catalog when it was summarized before
+    """
+    paperID = message.text.replace("/summarize", "", 1).strip()
+    if not paperID:
+        bot.reply_to(message, 'Usage: /summarize {paperID} (e.g. /summarize 2403.03186)')
+        return
+    paper = get_catalog().get(paperID)
+    if paper is None or paper['state'] != STATE_DOWNLOADED:
+        bot.reply_to(message, f"{paperID} isn't downloaded yet, get it with /paper {paperID} first.")
+        return
+    if paper['generated_summary']:
+        bot.reply_to(message, paper['generated_summary'])
+        return
+    bot.reply_to(message, f"Summarizing {paper['title']}…")
+    chain(
+        summarize_paper.s(paperID),
+        send_reply.s(message.chat.id, message.message_id)
+    ).apply_async(link_error=send_failure_reply.s(message.chat.id, message.message_id,
+                                                  f"Could not summarize {paperID}, try again later."))
+
+def zotero_configured():
+    """
+    Check whether papers should be added to Zotero
+    :return: bool
+    """
+    return bool(os.getenv('ZOTERO_API_KEY') and os.getenv('ZOTERO_LIBRARY_ID'))
+
+def zotero_write_token(paperID, step):
+    """
+    Zotero-Write-Token of an ingestion step, the same for every attempt of the step
+    :param paperID: arXiv ID of the paper
+    :param step: 'item' or 'attachment'
+    :return: str, 32 hex digits
+    """
+    return hashlib.md5(f"{paperID}:{step}".encode('utf-8')).hexdigest()
+
+def ingestion_step(task, state, step):
+    """
+    Run one step of the Zotero ingestion of a paper, retrying network failures with
+    exponential backoff. Once the retries are exhausted, or on any other error, the
+    error is recorded in the state, so the report still lists the other papers.
+    :param task: the bound celery task running the step
+    :param state: dict with 'paper_id' and 'error', passed along the chain
+    :param step: function of the paper record doing the work, returns a status text
+    :return: dict, the state for the next step
+    """
+    if state['error']:
+        return state
+    paperID = state['paper_id']
+    try:
+        paper = get_catalog().get(paperID)
+        if paper is None:
+            raise ValueError("not in the catalog")
+        state['status'] = step(paper)
+    except RequestException as e:
+        if task.request.retries < task.max_retries:
+            logger.warning(f"{task.name} failed for {paperID}, retrying: {e}")
+            raise task.retry(exc=e, countdown=ZOTERO_RETRY_DELAY * 2 ** task.request.retries)
+        logger.error(f"{task.name} failed for {paperID}: {e}")
+        state['error'] = str(e)
+    except Exception as e:
+        logger.error(f"{task.name} failed for {paperID}: {e}")
+        state['error'] = str(e)
+    return state
+
+@app.task(bind=True)
+def ingest_papers_zotero(self, paper_ids, chat_id, reply_to_message_id=None):
+    """
+    task: add downloaded papers to Zotero, replacing itself with a chord of one
+    create_zotero_item -> attach_zotero_pdf chain per paper, reported in one message
 
-@app.task
-def upload_pdf_zotero(paper_id):
-    """Upload a PDF file to Zotero library
-    
     Args:
-        paper_id (str): arXiv paper ID (e.g. 2403.03186)
-    
+        paper_ids (list): arXiv IDs of downloaded papers
+        chat_id (int): telegram chat id
+        reply_to_message_id (int, optional): message to reply to
+    """
+    if not paper_ids:
+        return []
+    return self.replace(chord(
+        [chain(create_zotero_item.s({'paper_id': paperID, 'error': None}), attach_zotero_pdf.s())
+         for paperID in paper_ids],
+        report_zotero_ingestion.s(chat_id, reply_to_message_id)
+    ))
+
+@app.task(bind=True, max_retries=ZOTERO_MAX_RETRIES)
+def create_zotero_item(self, state):
+    """
+    task: create the journalArticle of a paper from its catalog metadata. Skipped when
+    the catalog or the Zotero mirror already know the item, so a retried chain doesn't
+    create duplicates. The write token makes a retry after a lost response find the
+    item created by the first attempt instead of creating another one.
+
+    Args:
+        state (dict): 'paper_id' and 'error' of the paper being ingested
+
     Returns:
-        str: Success/failure message
+        dict: the state for attach_zotero_pdf
     """
-    try:
-        # Check if PDF exists
-        pdf_file = pdf_path / f"{paper_id}.pdf"
-        if not pdf_file.exists():
-            logger.error(f"Error: PDF file not found at {pdf_file}")
-            return f"Error: PDF file not found at {pdf_file}"
-
-        # Get paper metadata from info file
-        info_file = pdf_path / f"{paper_id}_info.txt"
-        if not info_file.exists():
-            return f"Error: Paper info file not found at {info_file}"
-            
-        # Read and parse metadata
-        with open(info_file, 'r', encoding='utf-8') as f:
-            content = f.read()
-
-        # Parse metadata with fixed order: title, url, author, summary
-        lines = content.split('\n')
-
-        # First three lines are title, url, author
-        title_key, title_value = lines[0].split(',', 1)
-        url_key, url_value = lines[1].split(',', 1)
-        author_key, author_value = lines[2].split(',', 1)
-
-        metadata = {
-            title_key.strip(): title_value.strip(),
-            url_key.strip(): url_value.strip(),
-            author_key.strip(): author_value.strip(),
-        }
-
-        # Everything after the third line is the summary
-        summary_key, summary_first_line = lines[3].split(',', 1)
-        metadata[summary_key.strip()] = '\n'.join([summary_first_line] + lines[4:]).strip()
-
-        logger.info("Parsed metadata:")
-        for key, value in metadata.items():
-            logger.info(f"{key}: {value[:50]}...")
-
-        logger.info("Final metadata:", metadata)
-
-        # Verify required metadata fields
-        required_fields = ['title', 'summary', 'url', 'author']
-        for field in required_fields:
-            if field not in metadata:
-                raise Exception(f"Missing required metadata field: {field}")
-
-        # Create Zotero item
-        logger.info("Creating Zotero item template")
-        template = zot.item_template('journalArticle')
-        template['title'] = metadata.get('title', '')
-        template['abstractNote'] = metadata.get('summary', '')
-        template['url'] = metadata.get('url', '')
-        # Parse authors and split into firstName/lastName
-        authors = metadata['author'].strip().rstrip(',').split(',')
-        template['creators'] = []
-        for author in authors:
-            if author.strip():
-                # Split name into parts
-                name_parts = author.strip().split()
-                if len(name_parts) > 1:
-                    template['creators'].append({
-                        'creatorType': 'author',
-                        'firstName': ' '.join(name_parts[:-1]),
-                        'lastName': name_parts[-1]
-                    })
-                else:
-                    template['creators'].append({
-                        'creatorType': 'author',
-                        'firstName': '',
-                        'lastName': name_parts[0]
-                    })
-        logger.info(f"Authors parsed: {template['creators']}")
-
-        logger.info("Uploading metadata to Zotero")
-       # Upload item metadata first
-        item = zot.create_items([template])
-        logger.info(item)
-        if not item or not item["success"]:
-            raise Exception("Failed to create Zotero item")
-
-        item = item["success"]
-        logger.info(f"item created: {item['0']}")
-        # # Then attach PDF
-        #print(f"Attaching PDF: {pdf_file}")
-        pdf_files = [pdf_file]
-        logger.info(f"Attaching PDF: {pdf_files}")
-        # response = zot.attachment_simple(
-        #         [str(pdf_file)],
-        #         item["0"]
-        #     )
-        test_pdf_path = Path("/mnt/books/Books/GPT") / "2311.02883.pdf"
-        response = zot.attachment_simple([str(test_pdf_path)], "K93PPGZ7")
-        # # with open(pdf_file, 'rb') as pdf:
-        #     zot.attachment_simple(
-        #         pdf,
-        #         item,
-        #         filename=f"{paper_id}.pdf"
-        #     )
-        logger.info(response)
-        if response and 'successful' in response:
-            logger.info("PDF uploaded successfully as a standalone item!")
+    def create(paper):
+        if paper['zotero_item_key']:
+            return 'item exists'
+        existing = get_zotero_mirror().find_by_url(paper['url']) if paper['url'] else None
+        if existing is not None:
+            get_catalog().set_zotero_keys(paper['arxiv_id'], existing['key'])
+            return 'item exists'
+
+        creators = []
+        for author in paper['authors']:
+            name_parts = author.split()
+            creators.append({
+                'creatorType': 'author',
+                'firstName': ' '.join(name_parts[:-1]),
+                'lastName': name_parts[-1] if name_parts else ''
+            })
+        client = get_zotero_client()
+        try:
+            item = client.create_item('journalArticle', {
+                'title': paper['title'],
+                'creators': creators,
+                'abstractNote': paper['summary'] or '',
+                'url': paper['url'] or '',
+                'publicationTitle': 'arXiv',
+                'extra': f"arXiv: {paper['arxiv_id']}",
+                'collections': [ZOTERO_COLLECTION] if ZOTERO_COLLECTION else [],
+            }, write_token=zotero_write_token(paper['arxiv_id'], 'item'))
+        except WriteTokenUsedError:
+            found = [obj['data'] for obj in client.search_items(paper['arxiv_id'], qmode='everything',
+                                                               itemType='journalArticle')
+                     if obj['data'].get('extra') == f"arXiv: {paper['arxiv_id']}"]
+            if not found:
+                raise ValueError("the item created earlier is no longer in Zotero, try again in 12 hours")
+            item = found[0]
+        get_catalog().set_zotero_keys(paper['arxiv_id'], item['key'])
+        get_zotero_mirror().save_items([item])
+        return 'item created'
+
+    return ingestion_step(self, state, create)
+
+@app.task(bind=True, max_retries=ZOTERO_MAX_RETRIES)
+def attach_zotero_pdf(self, state):
+    """
+    task: attach the PDF of a paper to its Zotero item. The attachment key is recorded
+    before the upload, so a retry resumes the upload instead of creating another
+    attachment, and a file Zotero already has isn't uploaded again. Like the item, the
+    attachment is created with a write token.
+
+    Args:
+        state (dict): 'paper_id' and 'error' of the paper being ingested
+
+    Returns:
+        dict: the state for report_zotero_ingestion
+    """
+    def attach(paper):
+        if paper['zotero_uploaded_at']:
+            return 'PDF exists'
+        client = get_zotero_client()
+        pdf_file = paper['pdf_file']
+        metadata = client.get_file_metadata(pdf_file)
+        attachment_key = paper['zotero_attachment_key']
+        if attachment_key is None:
+            existing = get_zotero_mirror().find_by_md5(metadata['md5'])
+            if existing is not None and existing.get('parentItem') == paper['zotero_item_key']:
+                get_catalog().set_zotero_keys(paper['arxiv_id'], paper['zotero_item_key'], existing['key'])
+                get_catalog().set_zotero_uploaded(paper['arxiv_id'])
+                return 'PDF exists'
+            try:
+                attachment = client.create_attachment(paper['zotero_item_key'], 'imported_file', {
+                    'title': metadata['filename'],
+                    'contentType': metadata['content_type'],
+                    'filename': metadata['filename'],
+                }, write_token=zotero_write_token(paper['arxiv_id'], 'attachment'))
+            except WriteTokenUsedError:
+                found = [obj['data'] for obj in client.get_children(paper['zotero_item_key'])
+                         if obj['data'].get('itemType') == 'attachment'
+                         and obj['data'].get('filename') == metadata['filename']]
+                if not found:
+                    raise ValueError("the attachment created earlier is no longer in Zotero, try again in 12 hours")
+                attachment = found[0]
+            attachment_key = attachment['key']
+            get_catalog().set_zotero_keys(paper['arxiv_id'], paper['zotero_item_key'], attachment_key)
+
+        client.upload_attachment_file(attachment_key, pdf_file, metadata)
+        get_catalog().set_zotero_uploaded(paper['arxiv_id'])
+        get_zotero_mirror().save_items([{
+            'key': attachment_key,
+            'data': {'itemType': 'attachment', 'parentItem': paper['zotero_item_key'],
+                     'title': metadata['filename'], 'filename': metadata['filename'], 'md5': metadata['md5']},
+        }])
+        return 'PDF uploaded'
+
+    return ingestion_step(self, state, attach)
+
+@app.task(ignore_result=True)
+def report_zotero_ingestion(states, chat_id, reply_to_message_id=None):
+    """
+    chord callback: tell the user which papers were added to Zotero
+
+    Args:
+        states (list): final state of every paper
+        chat_id (int): telegram chat id
+        reply_to_message_id (int, optional): message to reply to
+    """
+    added = sum(1 for state in states if not state['error'])
+    lines = [f"Zotero: {added}/{len(states)} papers added"]
+    for state in states:
+        if state['error']:
+            lines.append(f"✗ {state['paper_id']}: {state['error']}")
         else:
-            logger.info("Failed to upload PDF:", response)
-        #print(f"Successfully uploaded to Zotero: {paper_id}")
-        return f"Successfully uploaded {paper_id} to Zotero"
+            lines.append(f"✓ {state['paper_id']}: {state.get('status', '')}")
+    send_reply('\n'.join(lines), chat_id, reply_to_message_id)
 
-    except Exception as e:
-        return f"Error uploading to Zotero: {str(e)}"
+@app.task(ignore_result=True)
+def sync_zotero_library():
+    """
+    periodic task: update the local mirror of the Zotero library with the items and
+    collections changed since the last sync
+    """
+    if not os.getenv('ZOTERO_API_KEY'):
+        logger.info("Zotero isn't configured, skipping library sync")
+        return
+    get_zotero_mirror().sync(get_zotero_client())
 
-def upload_pdf_to_zotero(pdf_path_str, collection_key=None):
+@worker_process_init.connect
+def init_worker_clients(**kwargs):
     """
-    Uploads a PDF file to Zotero using the Zotero API.
+    Give every forked worker process its own HTTP session and API clients,
+    created before the first task so their connection pools are ready
+    """
+    for factory in (get_session, get_openai_client, get_zotero_client, get_arxiv_client):
+        factory.reset()
+        factory()
+    logger.info(f"Initialized API clients in worker process {os.getpid()}")
+
+@app.task(ignore_result=True)
+def health_check():
+    """
+    task: check that the worker can reach OpenAI and Zotero with its clients
+
+    Returns:
+        str: one status line per service
+    """
+    checks = {
+        'OpenAI': lambda: get_openai_client().models.list(),
+        'Zotero': lambda: get_zotero_client().get_key_info(),
+    }
+    lines = [f"worker pid {os.getpid()}"]
+    for name, check in checks.items():
+        start = time.monotonic()
+        try:
+            check()
+            lines.append(f"{name}: ok ({(time.monotonic() - start) * 1000:.0f} ms)")
+        except Exception as e:
+            lines.append(f"{name}: error {e}")
+    return '\n'.join(lines)
+
+@app.task
+def io_probe(delay=1.0, url=None):
+    """
+    task: wait on I/O without using CPU, used by load_test.py to measure how many
+    I/O bound tasks a worker runs concurrently
 
     Args:
-        pdf_path_str (str): Path to the PDF file.
-        collection_key (str, optional): Key of the Zotero collection to upload to. Defaults to None (My Library).
+        delay (float): seconds to sleep when no url is given
+        url (str, optional): fetch this url with the shared session instead of sleeping
 
     Returns:
-        dict: The response from the Zotero API, or None if an error occurred.
+        float: seconds the task took
     """
-    api_key = os.getenv('ZOTERO_API_KEY')
-    user_id = os.getenv('ZOTERO_LIBRARY_ID')
-    try:
-        pdf_path = Path(pdf_path_str)
-        with open(pdf_path, 'rb') as pdf_file:
-            pdf_data = pdf_file.read()
-
-        filename = pdf_path.name
-        filesize = len(pdf_data)
-        filehash = hashlib.sha1(pdf_data).hexdigest()
-
-        headers = {
-            'Zotero-API-Key': api_key,
-            'Zotero-API-Version': '3',
-            'Content-Type': 'application/json',
-        }
-
-        url = f'https://api.zotero.org/users/{user_id}/items'
-
-        if collection_key:
-            url = f'https://api.zotero.org/collections/{collection_key}/items'
-
-        # First, create an item with file metadata
-        item_data = {
-            'itemType': 'attachment',
-            'linkMode': 'imported_file',
-            'filename': filename,
-            "contentType": "application/pdf",
-        }
-
-        response = requests.post(url, headers=headers, json=[item_data]) #send as a list
-        response.raise_for_status()
-
-        response_json = response.json()
-        if not response_json:
-            print("Error: No JSON response from Zotero API during item creation.")
-            return None
-        if not isinstance(response_json, list) or not response_json: # check if response is a list and not empty
-            print(f"Error: unexpected response structure: {response_json}")
-            return None
-
-        upload_url = response_json[0]['data']['url']
-        upload_auth = response_json[0]['data']['authorization']
-
-        # Second, upload the file to the provided URL
-        upload_headers = {
-            'Authorization': upload_auth,
-            'Content-Type': 'application/pdf',
-            'Content-Disposition': f'attachment; filename="{filename}"',
-        }
-
-        upload_response = requests.put(upload_url, headers=upload_headers, data=pdf_data)
-        upload_response.raise_for_status()
-
-        # Third, confirm the upload
-        confirm_url = f'https://api.zotero.org/users/{user_id}/items/{response_json[0]["data"]["key"]}'
-        confirm_headers = {
-            'Zotero-API-Key': api_key,
-            'Zotero-API-Version': '3',
-            'If-Match': response.headers['ETag'],
-        }
-
-        confirm_data = {
-            "itemType": "attachment",
-            "linkMode": "imported_file",
-            "filename": filename,
-            "filesize": filesize,
-            "filehash": filehash,
-            "contentType": "application/pdf"
-
-        }
-
-        confirm_response = requests.patch(confirm_url, headers=confirm_headers, json=confirm_data)
-        confirm_response.raise_for_status()
-
-        return confirm_response.json()
-
-    except requests.exceptions.RequestException as e:
-        print(f"Error uploading PDF: {e}")
-        if 'response' in locals() and response is not None:
-            print(f"Response Content: {response.content}")
-        return None
-    except FileNotFoundError:
-        print(f"Error: PDF file not found at {pdf_path}")
-        return None
-    except json.JSONDecodeError:
-        print(f"Error: Invalid JSON response from Zotero API. Response: {response.text}")
-        return None
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}")
-        return None
-        
+    start = time.monotonic()
+    if url:
+        get_session().get(url).close()
+    else:
+        time.sleep(delay)
+    return time.monotonic() - start
+
+@bot.message_handler(commands=['health'])
+def handle_health(message):
+    """
+    report the health of a worker
+    """
+    chain(
+        health_check.s(),
+        send_reply.s(message.chat.id, message.message_id)
+    ).apply_async(link_error=send_failure_reply.s(message.chat.id, message.message_id, "Health check failed."))
+
 
 @bot.message_handler(func=lambda message: True)
 def echo_message(message):
@@ -613,21 +1439,53 @@ def echo_message(message):
 
     # Handle /clear command
     if message.text == '/clear':
-        conversations[user_id] = {'conversations': [], 'responses': []}
+        conversations.delete(user_id)
         bot.reply_to(message, "Conversations and responses cleared!")
         return
 
-    response = conversation_tracking(message.text, user_id)
+    if not scheduler.admit(user_id):
+        bot.reply_to(message, "You're sending messages too fast, please wait a moment and try again.")
+        return
+
+    position = scheduler.queue_position()
 
-    # Reply to message
-    bot.reply_to(message, response)
+    # the reply is delivered by the worker once the completion is done
+    conversation_tracking(message.text, user_id, message.message_id)
+
+    if position is not None:
+        bot.reply_to(message, f"You're queued, position {position}. I'll answer as soon as I can.")
+
+
+async def run_bot():
+    """
+    Receive telegram updates (long polling or webhook, see BOT_MODE) and handle them
+    concurrently, one chat at a time
+    """
+    executor = ThreadPoolExecutor(max_workers=BOT_WORKERS, thread_name_prefix='bot-handler')
+    pipeline = UpdatePipeline(lambda update: bot.process_new_updates([update]),
+                              max_in_flight=BOT_MAX_IN_FLIGHT, executor=executor)
+    try:
+        if BOT_MODE == 'webhook':
+            if WEBHOOK_URL:
+                logger.info(f"registering telegram webhook: {WEBHOOK_URL}")
+                bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET)
+            await serve_webhook(pipeline, host=WEBHOOK_LISTEN, port=WEBHOOK_PORT,
+                                path=WEBHOOK_PATH, secret_token=WEBHOOK_SECRET)
+        else:
+            # getUpdates is refused while a webhook is registered
+            bot.remove_webhook()
+            logger.info("start polling telegram bot..")
+            await poll_updates(bot, pipeline)
+    finally:
+        executor.shutdown(wait=False)
 
 
 if __name__ == "__main__":
+    if BOT_MODE == 'webhook' and not WEBHOOK_SECRET:
+        raise SystemExit("BOT_MODE=webhook requires WEBHOOK_SECRET, otherwise anyone can post updates")
     while True:
         try:
-            logger.info("start polling telegram bot..")
-            bot.polling(non_stop=True, interval=1)
+            asyncio.run(run_bot())
         except KeyboardInterrupt:
             logger.info("Keyboard interrupt received. Exiting...")
             break
@@ -0,0 +1,229 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+from typing import Any, Dict, List, Optional
+
+from sqlite_util import connect
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_messages(messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """
+    Normalize chat messages so trivially different prompts share a cache entry.
+
+    Args:
+        messages: chat messages
+
+    Returns:
+        Messages with surrounding and repeated whitespace collapsed
+    """
+    return [{'role': message['role'], 'content': ' '.join(message['content'].split())} for message in messages]
+
+
+def cache_key(params: Dict[str, Any], messages: List[Dict[str, str]]) -> str:
+    """
+    Key of a chat completion request.
+
+    Args:
+        params: model and sampling parameters of the request
+        messages: chat messages sent to the model
+
+    Returns:
+        Hex sha256 digest of the parameters and the normalized messages
+    """
+    payload = json.dumps({'params': params, 'messages': normalize_messages(messages)}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def is_cacheable(params: Dict[str, Any], message_list: List[Dict[str, str]], summary: Optional[str] = None) -> bool:
+    """
+    Cache policy: only requests whose answer doesn't depend on chance or on a
+    conversation, i.e. greedy sampling or a single-turn question.
+
+    Args:
+        params: model and sampling parameters of the request
+        message_list: conversation history and prompt (without preamble)
+        summary: running summary of the conversation, if any
+
+    Returns:
+        True if the completion may be served from the cache
+    """
+    if params.get('temperature') == 0:
+        return True
+    return len(message_list) == 1 and not summary
+
+
+class CompletionCache:
+    """Interface of the chat completion caches."""
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Look up a completion, counting the hit or miss.
+
+        Args:
+            key: see cache_key
+
+        Returns:
+            The cached completion, or None
+        """
+        raise NotImplementedError
+
+    def set(self, key: str, completion: str) -> None:
+        """
+        Store a completion, evicting the least recently used ones beyond the size limit.
+
+        Args:
+            key: see cache_key
+            completion: completion text
+        """
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns:
+            Dict with the 'hits', 'misses' and 'entries' counters
+        """
+        raise NotImplementedError
+
+
+class RedisCompletionCache(CompletionCache):
+    """
+    Redis backed cache shared by all workers.
+
+    Completions are string keys expiring after ``ttl``, a sorted set keyed by last
+    access time keeps the LRU order for the size limit.
+    """
+
+    def __init__(self, url: str, ttl: int = 86400, max_entries: int = 10000,
+                 prefix: str = 'chatbot:completion:', redis_client=None):
+        """
+        Args:
+            url: redis url, e.g. redis://localhost:6379/0
+            ttl: seconds a completion is kept
+            max_entries: maximum number of cached completions
+            prefix: key prefix
+            redis_client: ready made client to use instead of connecting to ``url``
+        """
+        if redis_client is None:
+            import redis
+            redis_client = redis.Redis.from_url(url)
+        self.redis = redis_client
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.prefix = prefix
+        self._lru = f"{prefix}lru"
+
+    def get(self, key: str) -> Optional[str]:
+        completion = self.redis.get(self.prefix + key)
+        if completion is None:
+            self.redis.incr(f"{self.prefix}misses")
+            return None
+        pipe = self.redis.pipeline()
+        pipe.zadd(self._lru, {key: time.time()})
+        pipe.incr(f"{self.prefix}hits")
+        pipe.execute()
+        return completion.decode('utf-8')
+
+    def set(self, key: str, completion: str) -> None:
+        pipe = self.redis.pipeline()
+        pipe.set(self.prefix + key, completion, ex=self.ttl)
+        pipe.zadd(self._lru, {key: time.time()})
+        # entries older than the ttl have expired already
+        pipe.zremrangebyscore(self._lru, '-inf', time.time() - self.ttl)
+        pipe.zcard(self._lru)
+        size = pipe.execute()[-1]
+
+        if size > self.max_entries:
+            evicted = [key for key, _ in self.redis.zpopmin(self._lru, size - self.max_entries)]
+            if evicted:
+                self.redis.delete(*[self.prefix + key.decode('utf-8') for key in evicted])
+
+    def stats(self) -> Dict[str, int]:
+        hits, misses = self.redis.mget(f"{self.prefix}hits", f"{self.prefix}misses")
+        return {'hits': int(hits or 0), 'misses': int(misses or 0), 'entries': self.redis.zcard(self._lru)}
+
+
+class SQLiteCompletionCache(CompletionCache):
+    """
+    Cache in a local SQLite file, for a single worker host without redis, shared by
+    its threads and worker processes.
+    """
+
+    def __init__(self, path: str, ttl: int = 86400, max_entries: int = 10000):
+        """
+        Args:
+            path: SQLite database file
+            ttl: seconds a completion is kept
+            max_entries: maximum number of cached completions
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        with connect(self.path) as db:
+            db.execute('CREATE TABLE IF NOT EXISTS completions '
+                       '(key TEXT PRIMARY KEY, completion TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)')
+            db.execute('CREATE INDEX IF NOT EXISTS completions_accessed ON completions (accessed)')
+            db.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+
+    def _count(self, db: sqlite3.Connection, name: str) -> None:
+        db.execute('INSERT INTO counters (name, value) VALUES (?, 1) '
+                   'ON CONFLICT (name) DO UPDATE SET value = value + 1', (name,))
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with connect(self.path) as db:
+            row = db.execute('SELECT completion FROM completions WHERE key = ? AND created > ?',
+                             (key, now - self.ttl)).fetchone()
+            if row is None:
+                self._count(db, 'misses')
+                return None
+            db.execute('UPDATE completions SET accessed = ? WHERE key = ?', (now, key))
+            self._count(db, 'hits')
+            return row[0]
+
+    def set(self, key: str, completion: str) -> None:
+        now = time.time()
+        with connect(self.path) as db:
+            db.execute('INSERT OR REPLACE INTO completions (key, completion, created, accessed) VALUES (?, ?, ?, ?)',
+                       (key, completion, now, now))
+            db.execute('DELETE FROM completions WHERE created <= ?', (now - self.ttl,))
+            db.execute('DELETE FROM completions WHERE key IN '
+                       '(SELECT key FROM completions ORDER BY accessed DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+    def stats(self) -> Dict[str, int]:
+        with connect(self.path) as db:
+            counters = dict(db.execute('SELECT name, value FROM counters').fetchall())
+            entries = db.execute('SELECT COUNT(*) FROM completions').fetchone()[0]
+        return {'hits': counters.get('hits', 0), 'misses': counters.get('misses', 0), 'entries': entries}
+
+
+def create_completion_cache() -> Optional[CompletionCache]:
+    """
+    Build the completion cache selected by the environment, caching is off by default:
+
+    - COMPLETION_CACHE: '' (off), 'redis' or 'sqlite'
+    - COMPLETION_CACHE_URL: redis url, defaults to CELERY_BROKER_URL
+    - COMPLETION_CACHE_PATH: SQLite file (default completion_cache.sqlite3)
+    - COMPLETION_CACHE_TTL: seconds a completion is kept (default 1 day)
+    - COMPLETION_CACHE_MAX_ENTRIES: maximum number of cached completions (default 10000)
+
+    Returns:
+        CompletionCache, or None if caching is off
+    """
+    backend = os.getenv('COMPLETION_CACHE', '')
+    ttl = int(os.getenv('COMPLETION_CACHE_TTL', '86400'))
+    max_entries = int(os.getenv('COMPLETION_CACHE_MAX_ENTRIES', '10000'))
+
+    if not backend:
+        return None
+    if backend == 'redis':
+        url = os.getenv('COMPLETION_CACHE_URL') or os.getenv('CELERY_BROKER_URL')
+        return RedisCompletionCache(url, ttl=ttl, max_entries=max_entries)
+    if backend == 'sqlite':
+        path = os.getenv('COMPLETION_CACHE_PATH', 'completion_cache.sqlite3')
+        return SQLiteCompletionCache(path, ttl=ttl, max_entries=max_entries)
+    raise ValueError(f"Unknown completion cache: {backend}")
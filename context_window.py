@@ -0,0 +1,138 @@
+import logging
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+import tiktoken
+
+logger = logging.getLogger(__name__)
+
+# tokens the chat format adds around every message (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+# tokens priming the assistant reply
+REPLY_PRIMING_TOKENS = 3
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str):
+    """
+    Get the tiktoken encoding of a model, loaded once per process.
+
+    Args:
+        model: OpenAI model name
+
+    Returns:
+        tiktoken.Encoding, or None if it can't be loaded (e.g. no network to fetch it)
+    """
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            # model unknown to this tiktoken version
+            return tiktoken.get_encoding('cl100k_base')
+    except Exception as e:
+        logger.error(f"Could not load tiktoken encoding for {model}, estimating token counts: {e}")
+        return None
+
+
+def count_tokens(text: str, model: str) -> int:
+    """
+    Count the tokens of a chat message content.
+
+    Args:
+        text: message content
+        model: OpenAI model name
+
+    Returns:
+        Number of tokens including the per-message overhead
+    """
+    encoding = get_encoding(model)
+    if encoding is None:
+        # about four characters per token for english text
+        return len(text) // 4 + 1 + MESSAGE_OVERHEAD_TOKENS
+    return len(encoding.encode(text, disallowed_special=())) + MESSAGE_OVERHEAD_TOKENS
+
+
+def new_turn(text: str, model: str) -> Dict[str, Any]:
+    """
+    Start a conversation turn for a user message.
+
+    Turns cache the token counts of their messages so history is never re-tokenized:
+    {'user': str, 'user_tokens': int, 'response': str | {'task_id': str} | None, 'response_tokens': int | None}
+
+    Args:
+        text: user message
+        model: OpenAI model name
+
+    Returns:
+        Dict describing the turn, its response still unset
+    """
+    return {'user': text, 'user_tokens': count_tokens(text, model), 'response': None, 'response_tokens': None}
+
+
+def turn_tokens(turn: Dict[str, Any]) -> Optional[int]:
+    """Tokens of a completed turn, None while its response is pending or failed."""
+    if not isinstance(turn['response'], str):
+        return None
+    return turn['user_tokens'] + turn['response_tokens']
+
+
+def pack_history(turns: List[Dict[str, Any]], budget: int) -> int:
+    """
+    Find how many of the newest turns fit into a token budget.
+
+    Turns without a response don't count against the budget and are left out of the
+    prompt, packing stops at the first completed turn that doesn't fit.
+
+    Args:
+        turns: conversation turns, oldest first
+        budget: tokens available for the history
+
+    Returns:
+        Index of the oldest turn in the packed window (len(turns) if none fits)
+    """
+    used = 0
+    start = len(turns)
+    for i in range(len(turns) - 1, -1, -1):
+        tokens = turn_tokens(turns[i])
+        if tokens is not None:
+            if used + tokens > budget:
+                break
+            used += tokens
+        start = i
+    return start
+
+
+def history_messages(turns: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """
+    Build the chat messages of the completed turns.
+
+    Args:
+        turns: conversation turns, oldest first
+
+    Returns:
+        List of user/assistant messages
+    """
+    messages = []
+    for turn in turns:
+        if turn_tokens(turn) is None:
+            continue
+        messages.append({"role": "user", "content": turn['user']})
+        messages.append({"role": "assistant", "content": turn['response']})
+    return messages
+
+
+def history_budget(context_tokens: int, max_tokens: int, reserved_tokens: int, history_tokens: int) -> int:
+    """
+    Tokens left for the conversation history.
+
+    Args:
+        context_tokens: context window of the model
+        max_tokens: tokens kept free for the reply
+        reserved_tokens: tokens of the fixed prompt parts (system messages, latest user message)
+        history_tokens: configured cap of the history
+
+    Returns:
+        Token budget of the history, never negative
+    """
+    available = context_tokens - max_tokens - reserved_tokens - REPLY_PRIMING_TOKENS
+    return max(0, min(history_tokens, available))
@@ -0,0 +1,244 @@
+import os
+import json
+import time
+import threading
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationStore:
+    """Interface of the per-user conversation history stores."""
+
+    def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Get the conversation record of a user.
+
+        Args:
+            user_id: telegram user id
+
+        Returns:
+            The record stored by ``set``, or None if unknown or expired
+        """
+        raise NotImplementedError
+
+    def set(self, user_id: int, record: Dict[str, Any]) -> None:
+        """
+        Store the conversation record of a user, restarting its time to live.
+
+        Args:
+            user_id: telegram user id
+            record: JSON serializable conversation record
+        """
+        raise NotImplementedError
+
+    def delete(self, user_id: int) -> None:
+        """
+        Forget the conversation of a user.
+
+        Args:
+            user_id: telegram user id
+        """
+        raise NotImplementedError
+
+    def add_reply(self, user_id: int, task_id: str, text: str) -> None:
+        """
+        Keep the reply of a completion until the bot merges it into the record.
+
+        Replies are kept apart from the record, so a worker adding one never overwrites
+        a record the bot is writing at the same time.
+
+        Args:
+            user_id: telegram user id
+            task_id: id of the completion task
+            text: the reply
+        """
+        raise NotImplementedError
+
+    def get_replies(self, user_id: int) -> Dict[str, str]:
+        """
+        Get the replies added for a user and not deleted yet.
+
+        Args:
+            user_id: telegram user id
+
+        Returns:
+            Dict of completion task id to reply
+        """
+        raise NotImplementedError
+
+    def delete_replies(self, user_id: int, task_ids: Iterable[str]) -> None:
+        """
+        Forget replies once they are merged into the record.
+
+        Args:
+            user_id: telegram user id
+            task_ids: ids of the completion tasks
+        """
+        raise NotImplementedError
+
+
+class InMemoryConversationStore(ConversationStore):
+    """
+    Process local store keeping the ``max_users`` most recently active users.
+
+    Records expire ``ttl`` seconds after their last update, the least recently used
+    user is evicted once the store is full.
+    """
+
+    def __init__(self, max_users: int = 10000, ttl: Optional[float] = None):
+        """
+        Args:
+            max_users: maximum number of users kept
+            ttl: seconds a record lives after its last update, None keeps it until evicted
+        """
+        self.max_users = max_users
+        self.ttl = ttl
+        self._records: OrderedDict = OrderedDict()
+        self._replies: Dict[int, Dict[str, str]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._records.get(user_id)
+            if entry is None:
+                return None
+            expires, record = entry
+            if expires is not None and expires <= time.monotonic():
+                del self._records[user_id]
+                return None
+            self._records.move_to_end(user_id)
+            return record
+
+    def set(self, user_id: int, record: Dict[str, Any]) -> None:
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._records[user_id] = (expires, record)
+            self._records.move_to_end(user_id)
+            self._evict()
+
+    def delete(self, user_id: int) -> None:
+        with self._lock:
+            self._records.pop(user_id, None)
+            self._replies.pop(user_id, None)
+
+    def add_reply(self, user_id: int, task_id: str, text: str) -> None:
+        with self._lock:
+            # replies only matter for users whose record is still kept
+            if user_id in self._records:
+                self._replies.setdefault(user_id, {})[task_id] = text
+
+    def get_replies(self, user_id: int) -> Dict[str, str]:
+        with self._lock:
+            return dict(self._replies.get(user_id, {}))
+
+    def delete_replies(self, user_id: int, task_ids: Iterable[str]) -> None:
+        with self._lock:
+            replies = self._replies.get(user_id, {})
+            for task_id in task_ids:
+                replies.pop(task_id, None)
+            if not replies:
+                self._replies.pop(user_id, None)
+
+    def _evict(self) -> None:
+        """Drop expired records from the cold end and trim to ``max_users``."""
+        now = time.monotonic()
+        while self._records:
+            user_id, (expires, _) = next(iter(self._records.items()))
+            if len(self._records) > self.max_users or (expires is not None and expires <= now):
+                del self._records[user_id]
+                self._replies.pop(user_id, None)
+            else:
+                break
+
+
+class RedisConversationStore(ConversationStore):
+    """
+    Redis backed store shared by every bot process.
+
+    Each user is one JSON string key with a time to live, so redis expires idle users
+    and memory stays bounded by the number of active users. Replies not merged yet are
+    a hash next to it, with the same time to live.
+    """
+
+    def __init__(self, url: str, ttl: Optional[float] = None, prefix: str = 'chatbot:conversation:', redis_client=None):
+        """
+        Args:
+            url: redis url, e.g. redis://localhost:6379/0
+            ttl: seconds a record lives after its last update, None keeps it forever
+            prefix: key prefix of the records
+            redis_client: ready made client to use instead of connecting to ``url``
+        """
+        if redis_client is None:
+            import redis
+            redis_client = redis.Redis.from_url(url)
+        self.redis = redis_client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _key(self, user_id: int) -> str:
+        return f"{self.prefix}{user_id}"
+
+    def _replies_key(self, user_id: int) -> str:
+        return f"{self.prefix}{user_id}:replies"
+
+    def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        data = self.redis.get(self._key(user_id))
+        if data is None:
+            return None
+        return json.loads(data)
+
+    def set(self, user_id: int, record: Dict[str, Any]) -> None:
+        ttl = int(self.ttl) if self.ttl is not None else None
+        self.redis.set(self._key(user_id), json.dumps(record), ex=ttl)
+
+    def delete(self, user_id: int) -> None:
+        self.redis.delete(self._key(user_id), self._replies_key(user_id))
+
+    def add_reply(self, user_id: int, task_id: str, text: str) -> None:
+        key = self._replies_key(user_id)
+        with self.redis.pipeline() as pipe:
+            pipe.hset(key, task_id, text)
+            if self.ttl is not None:
+                pipe.expire(key, int(self.ttl))
+            pipe.execute()
+
+    def get_replies(self, user_id: int) -> Dict[str, str]:
+        return {task_id.decode('utf-8'): text.decode('utf-8')
+                for task_id, text in self.redis.hgetall(self._replies_key(user_id)).items()}
+
+    def delete_replies(self, user_id: int, task_ids: Iterable[str]) -> None:
+        task_ids = list(task_ids)
+        if task_ids:
+            self.redis.hdel(self._replies_key(user_id), *task_ids)
+
+
+def create_conversation_store() -> ConversationStore:
+    """
+    Build the conversation store selected by the environment:
+
+    - CONVERSATION_STORE: 'memory' (default) or 'redis'
+    - CONVERSATION_STORE_URL: redis url, defaults to CELERY_BROKER_URL
+    - CONVERSATION_TTL: seconds an idle conversation is kept (default 7 days)
+    - CONVERSATION_MAX_USERS: users kept by the memory store (default 10000)
+
+    Returns:
+        ConversationStore
+    """
+    backend = os.getenv('CONVERSATION_STORE', 'memory')
+    ttl = float(os.getenv('CONVERSATION_TTL', str(7 * 24 * 3600)))
+
+    if backend == 'redis':
+        url = os.getenv('CONVERSATION_STORE_URL') or os.getenv('CELERY_BROKER_URL')
+        logger.info("Using redis conversation store")
+        return RedisConversationStore(url, ttl=ttl)
+    if backend != 'memory':
+        raise ValueError(f"Unknown conversation store: {backend}")
+
+    max_users = int(os.getenv('CONVERSATION_MAX_USERS', '10000'))
+    return InMemoryConversationStore(max_users=max_users, ttl=ttl)
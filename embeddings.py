@@ -0,0 +1,155 @@
+import os
+import re
+import zlib
+import logging
+from typing import Callable, List
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r'\w+')
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """
+    Scale every row to unit length, so a dot product is the cosine similarity.
+
+    Args:
+        vectors: (n, dim) array
+
+    Returns:
+        float32 (n, dim) array, all-zero rows are left as they are
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class Embedder:
+    """Turns texts into unit length float32 vectors of ``dim`` dimensions."""
+
+    # identifies the model, an index only accepts vectors of the embedder that built it
+    name = ''
+    dim = 0
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """
+        Args:
+            texts: texts to embed
+
+        Returns:
+            float32 array of shape (len(texts), dim) with unit length rows
+        """
+        raise NotImplementedError
+
+
+class HashingEmbedder(Embedder):
+    """
+    Local CPU embedder without a model: words and word pairs are hashed into ``dim``
+    buckets with a random sign (the hashing trick) and weighted by log term frequency.
+
+    It only captures lexical overlap, but needs no download, GPU or API calls.
+    """
+
+    def __init__(self, dim: int = 384):
+        """
+        Args:
+            dim: number of dimensions
+        """
+        self.dim = dim
+        self.name = f'hashing-{dim}'
+
+    def _features(self, text: str) -> List[str]:
+        words = _WORD.findall(text.lower())
+        return words + [f'{a} {b}' for a, b in zip(words, words[1:])]
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            features = self._features(text)
+            if not features:
+                continue
+            hashes = np.fromiter((zlib.crc32(feature.encode('utf-8')) for feature in features),
+                                 dtype=np.uint32, count=len(features))
+            buckets = hashes % self.dim
+            signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+            counts = np.zeros(self.dim, dtype=np.float32)
+            np.add.at(counts, buckets, signs)
+            vectors[row] = np.sign(counts) * np.log1p(np.abs(counts))
+        return normalize_rows(vectors)
+
+
+class OpenAIEmbedder(Embedder):
+    """Embeddings from the OpenAI API, sent in batches."""
+
+    def __init__(self, client_factory: Callable, model: str = 'text-embedding-3-small', dim: int = 1536,
+                 batch_size: int = 100):
+        """
+        Args:
+            client_factory: returns the OpenAI client of the current process
+            model: embedding model
+            dim: dimensions of the model's vectors
+            batch_size: texts per API request
+        """
+        self.client_factory = client_factory
+        self.model = model
+        self.dim = dim
+        self.batch_size = batch_size
+        self.name = f'openai-{model}'
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            response = self.client_factory().embeddings.create(
+                model=self.model, input=texts[start:start + self.batch_size])
+            vectors.extend(item.embedding for item in response.data)
+        return normalize_rows(np.array(vectors, dtype=np.float32).reshape(len(texts), self.dim))
+
+
+class SentenceTransformerEmbedder(Embedder):
+    """Local CPU model from sentence-transformers, which is not installed by default."""
+
+    def __init__(self, model: str = 'all-MiniLM-L6-v2'):
+        """
+        Args:
+            model: sentence-transformers model name or path
+        """
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError("EMBEDDER=sentence-transformers needs: pip install sentence-transformers") from e
+        self.model = SentenceTransformer(model, device='cpu')
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.name = f'st-{model}'
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        return normalize_rows(self.model.encode(texts, batch_size=32, convert_to_numpy=True))
+
+
+def create_embedder(openai_client_factory: Callable = None) -> Embedder:
+    """
+    Build the embedder selected by the environment:
+
+    - EMBEDDER: 'hashing' (default), 'openai' or 'sentence-transformers'
+    - EMBEDDING_MODEL: model of the openai or sentence-transformers embedder
+    - EMBEDDING_DIM: dimensions of the hashing or openai embedder
+
+    Args:
+        openai_client_factory: returns the OpenAI client, needed for EMBEDDER=openai
+
+    Returns:
+        Embedder
+    """
+    backend = os.getenv('EMBEDDER', 'hashing')
+    model = os.getenv('EMBEDDING_MODEL')
+    dim = os.getenv('EMBEDDING_DIM')
+
+    if backend == 'hashing':
+        return HashingEmbedder(int(dim or 384))
+    if backend == 'openai':
+        return OpenAIEmbedder(openai_client_factory, model or 'text-embedding-3-small', int(dim or 1536))
+    if backend == 'sentence-transformers':
+        return SentenceTransformerEmbedder(model or 'all-MiniLM-L6-v2')
+    raise ValueError(f"Unknown embedder: {backend}")
@@ -0,0 +1,135 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# celery message priorities on the redis transport, 0 is served first
+PRIORITY_SHORT = 0
+PRIORITY_LONG = 5
+PRIORITY_MULTI_TURN_PENALTY = 2
+
+
+class TokenBucket:
+    """Token bucket refilled at ``rate`` tokens per second up to ``capacity``."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, tokens: float = 1) -> bool:
+        """
+        Take tokens out of the bucket.
+
+        Args:
+            tokens: number of tokens needed
+
+        Returns:
+            True if there were enough tokens
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < tokens:
+            return False
+        self.tokens -= tokens
+        return True
+
+
+class FairScheduler:
+    """
+    Admission and priority decisions in front of the chat queue.
+
+    - every user has a token bucket, so a single chatty user can't flood the workers
+    - short single-turn prompts get a better priority than long multi-turn ones
+    - once the queue is deeper than ``saturation_depth`` the caller learns the
+      position of the new request, to tell the user they are queued
+    """
+
+    def __init__(self, queue_depth: Callable[[], int], rate_per_minute: float = 10, burst: int = 5,
+                 saturation_depth: int = 20, short_prompt_tokens: int = 500,
+                 depth_cache_seconds: float = 1.0, max_users: int = 10000):
+        """
+        Args:
+            queue_depth: returns the number of messages waiting in the chat queue
+            rate_per_minute: sustained requests per user and minute
+            burst: requests a user may send at once
+            saturation_depth: queue depth from which users are told their position
+            short_prompt_tokens: prompts up to this many tokens count as short
+            depth_cache_seconds: how long a queue depth reading is reused
+            max_users: buckets kept, the least recently active users are forgotten
+        """
+        self.queue_depth = queue_depth
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.saturation_depth = saturation_depth
+        self.short_prompt_tokens = short_prompt_tokens
+        self.depth_cache_seconds = depth_cache_seconds
+        self.max_users = max_users
+        self._buckets: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._depth = 0
+        self._depth_read = None
+
+    def admit(self, user_id: int) -> bool:
+        """
+        Check the rate limit of a user, consuming one request.
+
+        Args:
+            user_id: telegram user id
+
+        Returns:
+            True if the request may be queued
+        """
+        with self._lock:
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst)
+                if len(self._buckets) > self.max_users:
+                    # a forgotten user simply starts over with a full bucket
+                    self._buckets.popitem(last=False)
+            self._buckets.move_to_end(user_id)
+            return bucket.take()
+
+    def priority(self, prompt_tokens: int, multi_turn: bool) -> int:
+        """
+        Priority of a chat request.
+
+        Args:
+            prompt_tokens: tokens of the prompt including history
+            multi_turn: True if the prompt carries conversation history
+
+        Returns:
+            Celery message priority, lower is served first
+        """
+        priority = PRIORITY_SHORT if prompt_tokens <= self.short_prompt_tokens else PRIORITY_LONG
+        if multi_turn:
+            priority += PRIORITY_MULTI_TURN_PENALTY
+        return priority
+
+    def queue_position(self) -> Optional[int]:
+        """
+        Position a new request would get in a saturated queue.
+
+        Returns:
+            The position, or None if the queue is not saturated (or can't be read)
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._depth_read is None or now - self._depth_read >= self.depth_cache_seconds:
+                try:
+                    self._depth = self.queue_depth()
+                except Exception as e:
+                    logger.error(f"Could not read queue depth: {e}")
+                    self._depth = 0
+                self._depth_read = now
+
+            # the caller is about to queue one more request
+            self._depth += 1
+            if self._depth <= self.saturation_depth:
+                return None
+            return self._depth
@@ -0,0 +1,169 @@
+import os
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import BinaryIO, Dict, Optional
+
+from sqlite_util import connect
+
+logger = logging.getLogger(__name__)
+
+# bytes read at a time while hashing or uploading
+CHUNK_SIZE = 1024 * 1024
+# SQLite file remembering the hashes of files across processes, '' to only cache in memory
+HASH_CACHE_PATH = os.getenv('HASH_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'file_hashes.sqlite3'))
+
+
+def hash_file(path: str, chunk_size: int = CHUNK_SIZE) -> Dict[str, str]:
+    """
+    Compute the md5 of a file over fixed-size chunks, so memory use doesn't grow with
+    the file.
+
+    Args:
+        path: file to hash
+        chunk_size: bytes read at a time
+
+    Returns:
+        Dict with the hex digest 'md5', the only one the Zotero API asks for
+    """
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            md5.update(chunk)
+    return {'md5': md5.hexdigest()}
+
+
+class FileHashCache:
+    """
+    Hashes of files keyed by (path, size, mtime), so a file is only hashed again once
+    it changed. Kept in memory and, if ``path`` is set, in a SQLite file shared by the
+    worker processes.
+    """
+
+    def __init__(self, path: Optional[str] = HASH_CACHE_PATH, max_memory_entries: int = 10000):
+        """
+        Args:
+            path: SQLite database file, None or '' to only cache in memory
+            max_memory_entries: hashes kept in memory
+        """
+        self.path = path or None
+        self.max_memory_entries = max_memory_entries
+        self._memory: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        if self.path:
+            with connect(self.path) as db:
+                # replaces the file_hashes table, which also held an unused sha1
+                db.execute('DROP TABLE IF EXISTS file_hashes')
+                db.execute('CREATE TABLE IF NOT EXISTS file_md5 (path TEXT PRIMARY KEY, size INTEGER NOT NULL, '
+                           'mtime_ns INTEGER NOT NULL, md5 TEXT NOT NULL)')
+
+    def get(self, path: str) -> Dict[str, str]:
+        """
+        Hashes of a file, computed only if the file is new or changed.
+
+        Args:
+            path: file to hash
+
+        Returns:
+            Dict with 'md5', 'size' (int) and 'mtime' (float, seconds)
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        key = (path, stat.st_size, stat.st_mtime_ns)
+
+        with self._lock:
+            digests = self._memory.get(key)
+            if digests is not None:
+                self._memory.move_to_end(key)
+        if digests is None and self.path:
+            with connect(self.path) as db:
+                row = db.execute('SELECT md5 FROM file_md5 WHERE path = ? AND size = ? AND mtime_ns = ?',
+                                 key).fetchone()
+            if row:
+                digests = {'md5': row[0]}
+        if digests is None:
+            digests = hash_file(path)
+            logger.debug(f"Hashed {path} ({stat.st_size} bytes)")
+            if self.path:
+                with connect(self.path) as db:
+                    db.execute('INSERT OR REPLACE INTO file_md5 (path, size, mtime_ns, md5) '
+                               'VALUES (?, ?, ?, ?)', key + (digests['md5'],))
+
+        with self._lock:
+            self._memory[key] = digests
+            if len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+        return {**digests, 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def file_hashes(path: str) -> Dict[str, str]:
+    """
+    Hashes of a file from the cache of the current process (see FileHashCache.get).
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = FileHashCache()
+    return _default_cache.get(path)
+
+
+class FileBody:
+    """
+    Upload body streaming ``prefix``, the file and ``suffix`` without loading the file
+    into memory. ``__len__`` lets requests send a Content-Length instead of chunked
+    encoding, which storage services like S3 require.
+    """
+
+    def __init__(self, path: str, prefix: bytes = b'', suffix: bytes = b'', chunk_size: int = CHUNK_SIZE):
+        """
+        Args:
+            path: file to send
+            prefix: bytes sent before the file (e.g. the multipart form fields)
+            suffix: bytes sent after the file (e.g. the closing multipart boundary)
+            chunk_size: bytes read from the file at a time
+        """
+        self.prefix = prefix
+        self.suffix = suffix
+        self.chunk_size = chunk_size
+        self._file: BinaryIO = open(path, 'rb')
+        self._length = len(prefix) + os.fstat(self._file.fileno()).st_size + len(suffix)
+        self._parts = [prefix, None, suffix]
+
+    def __len__(self) -> int:
+        return self._length
+
+    def read(self, size: int = -1) -> bytes:
+        """Read up to ``size`` bytes (everything that is left for a negative size)."""
+        if size is None or size < 0:
+            size = self._length
+        data = b''
+        while self._parts and len(data) < size:
+            part = self._parts[0]
+            if part is None:
+                chunk = self._file.read(min(size - len(data), self.chunk_size))
+                if not chunk:
+                    self._parts.pop(0)
+                data += chunk
+            else:
+                take = size - len(data)
+                data += part[:take]
+                if take >= len(part):
+                    self._parts.pop(0)
+                else:
+                    self._parts[0] = part[take:]
+        return data
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self) -> 'FileBody':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,96 @@
+import os
+import logging
+import threading
+import functools
+from typing import Callable, TypeVar
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# connection pool and retry settings of the shared session
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '10'))
+HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', '3'))
+HTTP_BACKOFF = float(os.getenv('HTTP_BACKOFF', '0.5'))
+HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', '30'))
+
+
+def per_process(factory: Callable[[], T]) -> Callable[[], T]:
+    """
+    Decorator caching the object built by ``factory`` once per process.
+
+    A child forked by a celery prefork pool builds its own object instead of sharing
+    the parent's sockets. ``reset()`` drops the cached object.
+    """
+    instances = {}
+    lock = threading.Lock()
+
+    @functools.wraps(factory)
+    def get() -> T:
+        pid = os.getpid()
+        instance = instances.get(pid)
+        if instance is None:
+            with lock:
+                if pid not in instances:
+                    # objects inherited from the parent process are never used here
+                    instances.clear()
+                    instances[pid] = factory()
+                instance = instances[pid]
+        return instance
+
+    get.reset = instances.clear
+    return get
+
+
+class TimeoutSession(requests.Session):
+    """requests.Session applying a default timeout to every request."""
+
+    def __init__(self, timeout: float):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+def create_session(pool_size: int = HTTP_POOL_SIZE, retries: int = HTTP_RETRIES,
+                   backoff: float = HTTP_BACKOFF, timeout: float = HTTP_TIMEOUT) -> requests.Session:
+    """
+    Create a keep-alive session with connection pooling, retries and a default timeout.
+
+    Only idempotent requests are retried (on connection errors, 429 and 5xx, honouring
+    Retry-After), so item creation or file uploads are never sent twice.
+
+    Args:
+        pool_size: connections kept open per host
+        retries: retries of a failed request
+        backoff: backoff factor between retries in seconds
+        timeout: default connect and read timeout in seconds
+
+    Returns:
+        requests.Session
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+    session = TimeoutSession(timeout)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    logger.debug(f"Created HTTP session in process {os.getpid()} (pool size {pool_size})")
+    return session
+
+
+# shared session of the current process
+get_session = per_process(create_session)
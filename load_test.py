@@ -0,0 +1,56 @@
+"""
+Load test of the worker pool profile.
+
+Queues bursts of io_probe tasks (I/O wait without CPU, like the OpenAI, arXiv and
+Zotero calls of the real tasks) and reports how many of them the workers of a queue
+ran concurrently. Compare a prefork worker with a gevent worker:
+
+    celery -A chatbot worker -Q chat -n chat@%h -P prefork -c 8
+    celery -A chatbot worker -Q chat -n chat@%h -P gevent -c 200
+
+    python load_test.py --queue chat --steps 10,50,100,200 --delay 1
+"""
+import time
+import argparse
+
+from celery import group
+
+from chatbot import io_probe
+
+
+def run_step(tasks, delay, queue, url=None, timeout=600):
+    """
+    Run one burst of probe tasks and wait for all of them.
+
+    Args:
+        tasks (int): number of tasks in the burst
+        delay (float): seconds each task waits
+        queue (str): queue to send the tasks to
+        url (str, optional): url the tasks fetch instead of sleeping
+        timeout (float): seconds to wait for the burst
+
+    Returns:
+        tuple: (wall clock seconds, summed task seconds)
+    """
+    start = time.monotonic()
+    result = group(io_probe.s(delay, url).set(queue=queue) for _ in range(tasks)).apply_async()
+    durations = result.get(timeout=timeout)
+    return time.monotonic() - start, sum(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--queue', default='chat', help="queue served by the worker under test")
+    parser.add_argument('--steps', default='10,50,100,200', help="comma separated burst sizes")
+    parser.add_argument('--delay', type=float, default=1.0, help="seconds of I/O wait per task")
+    parser.add_argument('--url', help="fetch this url instead of sleeping")
+    args = parser.parse_args()
+
+    print(f"{'tasks':>6} {'wall s':>8} {'tasks/s':>8} {'concurrency':>12}")
+    for tasks in (int(step) for step in args.steps.split(',')):
+        wall, busy = run_step(tasks, args.delay, args.queue, args.url)
+        print(f"{tasks:>6} {wall:>8.2f} {tasks / wall:>8.1f} {busy / wall:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
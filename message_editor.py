@@ -0,0 +1,84 @@
+import time
+import logging
+from typing import Any, Optional
+
+from telebot.apihelper import ApiTelegramException
+
+logger = logging.getLogger(__name__)
+
+# telegram refuses longer messages
+MAX_MESSAGE_LENGTH = 4096
+
+
+class ThrottledMessage:
+    """
+    A telegram message whose text is edited in place while it grows.
+
+    Updates are coalesced: the message is edited at most once per ``interval`` seconds
+    (telegram rate limits edits), and only when the text changed. Text beyond the
+    telegram length limit continues in a new message.
+    """
+
+    def __init__(self, bot: Any, chat_id: int, reply_to_message_id: Optional[int] = None,
+                 placeholder: str = '…', interval: float = 1.0):
+        """
+        Send the placeholder message.
+
+        Args:
+            bot: telebot.TeleBot
+            chat_id: telegram chat id
+            reply_to_message_id: message the first message replies to
+            placeholder: text shown until the first update
+            interval: minimum seconds between two edits
+        """
+        self.bot = bot
+        self.chat_id = chat_id
+        self.interval = interval
+        self._message = bot.send_message(chat_id, placeholder, reply_to_message_id=reply_to_message_id)
+        self._offset = 0  # start of the text shown in the current message
+        self._shown = placeholder
+        self._last_edit = time.monotonic()
+
+    def update(self, text: str) -> None:
+        """
+        Show the text, unless the last edit is too recent.
+
+        Args:
+            text: full text so far
+        """
+        # move on to a new message once the current one is full
+        while len(text) - self._offset > MAX_MESSAGE_LENGTH:
+            # the full message is never edited again, so this edit must not be dropped
+            self._edit(text[self._offset:self._offset + MAX_MESSAGE_LENGTH], wait_rate_limit=True)
+            self._offset += MAX_MESSAGE_LENGTH
+            self._message = self.bot.send_message(self.chat_id, text[self._offset:self._offset + MAX_MESSAGE_LENGTH])
+            self._shown = self._message.text
+            self._last_edit = time.monotonic()
+
+        if time.monotonic() - self._last_edit >= self.interval:
+            self._edit(text[self._offset:])
+
+    def finish(self, text: str) -> None:
+        """
+        Show the final text.
+
+        Args:
+            text: complete text
+        """
+        self.update(text)
+        self._edit(text[self._offset:], wait_rate_limit=True)
+
+    def _edit(self, text: str, wait_rate_limit: bool = False) -> None:
+        if not text or text == self._shown:
+            return
+        try:
+            self.bot.edit_message_text(text, self.chat_id, self._message.message_id)
+            self._shown = text
+        except ApiTelegramException as e:
+            retry_after = ((e.result_json or {}).get('parameters') or {}).get('retry_after')
+            if wait_rate_limit and e.error_code == 429 and retry_after:
+                time.sleep(retry_after)
+                return self._edit(text)
+            # otherwise the next update catches up
+            logger.warning(f"Could not edit message {self._message.message_id}: {e}")
+        self._last_edit = time.monotonic()
@@ -0,0 +1,339 @@
+import re
+import json
+import time
+import sqlite3
+import logging
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlite_util import connect
+
+logger = logging.getLogger(__name__)
+
+# download states of a paper
+STATE_PENDING = 'pending'
+STATE_DOWNLOADED = 'downloaded'
+STATE_FAILED = 'failed'
+
+# schema changes, applied in order and tracked with PRAGMA user_version
+MIGRATIONS = [
+    [
+        'CREATE TABLE papers ('
+        ' arxiv_id TEXT PRIMARY KEY,'
+        ' title TEXT NOT NULL COLLATE NOCASE,'
+        ' authors TEXT NOT NULL,'
+        ' url TEXT,'
+        ' summary TEXT,'
+        ' state TEXT NOT NULL,'
+        ' pdf_file TEXT,'
+        ' zotero_item_key TEXT,'
+        ' zotero_attachment_key TEXT,'
+        ' updated_at REAL NOT NULL)',
+        'CREATE INDEX papers_title ON papers (title)',
+        'CREATE TABLE paper_authors ('
+        ' arxiv_id TEXT NOT NULL REFERENCES papers (arxiv_id) ON DELETE CASCADE,'
+        ' position INTEGER NOT NULL,'
+        ' name TEXT NOT NULL COLLATE NOCASE,'
+        ' PRIMARY KEY (arxiv_id, position))',
+        'CREATE INDEX paper_authors_name ON paper_authors (name)',
+        'CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)',
+    ],
+    [
+        # full text of the downloaded PDFs, ranked with bm25
+        "CREATE VIRTUAL TABLE paper_text USING fts5"
+        "(arxiv_id UNINDEXED, title, body, tokenize = 'porter unicode61')",
+        'ALTER TABLE papers ADD COLUMN indexed_at REAL',
+    ],
+    [
+        # summary of the full text generated by /summarize
+        'ALTER TABLE papers ADD COLUMN generated_summary TEXT',
+    ],
+    [
+        # set once the PDF of the Zotero attachment is uploaded and registered
+        'ALTER TABLE papers ADD COLUMN zotero_uploaded_at REAL',
+    ],
+]
+
+# bm25 weights of the paper_text columns, a match in the title counts more than in the body
+_BM25_WEIGHTS = (0.0, 10.0, 1.0)
+
+# layout of the legacy {paperID}_info.txt files written before the catalog existed
+_SIDECAR = re.compile(r'^title, (?P<title>.*?)\nurl, (?P<url>.*?)\nauthor, (?P<authors>.*?)\nsummary, (?P<summary>.*)$',
+                      re.DOTALL)
+
+
+class PaperCatalog:
+    """
+    SQLite catalog of downloaded papers: metadata, download state and Zotero keys,
+    looked up by arXiv ID, title or author through indexes, shared by the bot and the
+    workers.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: SQLite database file
+        """
+        self.path = path
+        with connect(self.path, rows=True, foreign_keys=True) as db:
+            if db.execute('PRAGMA user_version').fetchone()[0] < len(MIGRATIONS):
+                # processes opening a new catalog at once migrate it one after the other
+                db.execute('BEGIN IMMEDIATE')
+                version = db.execute('PRAGMA user_version').fetchone()[0]
+                for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+                    for statement in statements:
+                        db.execute(statement)
+                    db.execute(f'PRAGMA user_version = {number}')
+                    logger.info(f"Migrated paper catalog {path} to schema version {number}")
+
+    @staticmethod
+    def _record(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        record = dict(row)
+        record['authors'] = json.loads(record['authors'])
+        return record
+
+    def get(self, arxiv_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a paper by arXiv ID.
+
+        Args:
+            arxiv_id: arXiv ID the paper was saved under
+
+        Returns:
+            The paper with 'authors' as a list, or None if it isn't in the catalog
+        """
+        with connect(self.path, rows=True, foreign_keys=True) as db:
+            return self._record(db.execute('SELECT * FROM papers WHERE arxiv_id = ?', (arxiv_id,)).fetchone())
+
+    def find_by_title(self, title: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        Papers whose title starts with ``title``, ignoring case.
+
+        Args:
+            title: title or beginning of a title
+            limit: maximum number of papers
+
+        Returns:
+            List of papers
+        """
+        with connect(self.path, rows=True, foreign_keys=True) as db:
+            rows = db.execute('SELECT * FROM papers WHERE title >= ? AND title < ? ORDER BY title LIMIT ?',
+                              _prefix_range(title) + (limit,)).fetchall()
+        return [self._record(row) for row in rows]
+
+    def find_by_author(self, name: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        Papers with an author whose name starts with ``name``, ignoring case.
+
+        Args:
+            name: author name or beginning of one
+            limit: maximum number of papers
+
+        Returns:
+            List of papers, most recently updated first
+        """
+        with connect(self.path, rows=True, foreign_keys=True) as db:
+            rows = db.execute('SELECT * FROM papers WHERE arxiv_id IN '
+                              '(SELECT arxiv_id FROM paper_authors WHERE name >= ? AND name < ?) '
+                              'ORDER BY updated_at DESC LIMIT ?',
+                              _prefix_range(name) + (limit,)).fetchall()
+        return [self._record(row) for row in rows]
+
+    def save_metadata(self, arxiv_id: str, title: str, authors: List[str], url: str, summary: str) -> None:
+        """
+        Add a paper or update its metadata, keeping its download state and Zotero keys.
+
+        Args:
+            arxiv_id: arXiv ID the files are named after
+            title: paper title
+            authors: author names in order
+            url: url of the PDF
+            summary: abstract
+        """
+        with connect(self.path, rows=True, foreign_keys=True) as db:
+            db.execute('INSERT INTO papers (arxiv_id, title, authors, url, summary, state, updated_at) '
+                       'VALUES (?, ?, ?, ?, ?, ?, ?) '
+                       'ON CONFLICT (arxiv_id) DO UPDATE SET title = excluded.title, authors = excluded.authors, '
+                       'url = excluded.url, summary = excluded.summary, updated_at = excluded.updated_at',
+                       (arxiv_id, title, json.dumps(authors), url, summary, STATE_PENDING, time.time()))
+            db.execute('DELETE FROM paper_authors WHERE arxiv_id = ?', (arxiv_id,))
+            db.executemany('INSERT INTO paper_authors (arxiv_id, position, name) VALUES (?, ?, ?)',
+                           [(arxiv_id, position, name) for position, name in enumerate(authors)])
+
+    def set_state(self, arxiv_id: str, state: str, pdf_file: Optional[str] = None) -> None:
+        """
+        Record the download state of a paper.
+
+        Args:
+            arxiv_id: arXiv ID of the paper
+            state: STATE_PENDING, STATE_DOWNLOADED or STATE_FAILED
+            pdf_file: path of the downloaded PDF
+        """
+        with connect(self.path, rows=True, foreign_keys=True) as db:
+            db.execute('UPDATE papers SET state = ?, pdf_file = COALESCE(?, pdf_file), updated_at = ? '
+                       'WHERE arxiv_id = ?', (state, pdf_file, time.time(), arxiv_id))
+
+    def set_zotero_keys(self, arxiv_id: str, item_key: str, attachment_key: Optional[str] = None) -> None:
+        """
+        Record the Zotero items of a paper.
+
+        Args:
+            arxiv_id: arXiv ID of the paper
+            item_key: key of the parent item
+            attachment_key: key of the PDF attachment
+        """
+        with connect(self.path, rows=True, foreign_keys=True) as db:
+            db.execute('UPDATE papers SET zotero_item_key = ?, '
+                       'zotero_attachment_key = COALESCE(?, zotero_attachment_key), updated_at = ? '
+                       'WHERE arxiv_id = ?', (item_key, attachment_key, time.time(), arxiv_id))
+
+    def index_text(self, arxiv_id: str, text: str) -> None:
+        """
+        Add the full text of a paper to the search index, replacing an older entry.
+
+        Args:
+            arxiv_id: arXiv ID of the paper
+            text: text extracted from the PDF
+        """
+        with connect(self.path, rows=True, foreign_keys=True) as db:
+            row = db.execute('SELECT title FROM papers WHERE arxiv_id = ?', (arxiv_id,)).fetchone()
+            if row is None:
+                raise KeyError(f"Paper {arxiv_id} is not in the catalog")
+            db.execute('DELETE FROM paper_text WHERE arxiv_id = ?', (arxiv_id,))
+            db.execute('INSERT INTO paper_text (arxiv_id, title, body) VALUES (?, ?, ?)',
+                       (arxiv_id, row['title'], text))
+            db.execute('UPDATE papers SET indexed_at = ? WHERE arxiv_id = ?', (time.time(), arxiv_id))
+
+    def downloaded(self) -> List[Dict[str, Any]]:
+        """
+        All downloaded papers.
+
+        Returns:
+            List of papers, oldest first
+        """
+        with connect(self.path, rows=True, foreign_keys=True) as db:
+            rows = db.execute('SELECT * FROM papers WHERE state = ? ORDER BY updated_at',
+                              (STATE_DOWNLOADED,)).fetchall()
+        return [self._record(row) for row in rows]
+
+    def text(self, arxiv_id: str) -> Optional[str]:
+        """
+        Full text of a paper as stored in the search index.
+
+        Args:
+            arxiv_id: arXiv ID of the paper
+
+        Returns:
+            The text, or None if the paper isn't indexed
+        """
+        with connect(self.path, rows=True, foreign_keys=True) as db:
+            row = db.execute('SELECT body FROM paper_text WHERE arxiv_id = ?', (arxiv_id,)).fetchone()
+        return row['body'] if row else None
+
+    def set_generated_summary(self, arxiv_id: str, summary: str) -> None:
+        """
+        Cache the generated summary of a paper.
+
+        Args:
+            arxiv_id: arXiv ID of the paper
+            summary: summary of the full text
+        """
+        with connect(self.path, rows=True, foreign_keys=True) as db:
+            db.execute('UPDATE papers SET generated_summary = ?, updated_at = ? WHERE arxiv_id = ?',
+                       (summary, time.time(), arxiv_id))
+
+    def search(self, query: str, limit: int = 10, snippet_tokens: int = 16) -> List[Dict[str, Any]]:
+        """
+        Full text search of the downloaded papers.
+
+        Every word of the query must appear in the title or text of a paper, the best
+        matches (bm25) come first.
+
+        Args:
+            query: words to search for, FTS5 operators are treated as plain words
+            limit: maximum number of hits
+            snippet_tokens: length of the snippet of each hit in tokens
+
+        Returns:
+            List of dicts with 'arxiv_id', 'title' and 'snippet' (matches marked with *)
+        """
+        match = ' '.join('"' + word.replace('"', '""') + '"' for word in query.split())
+        if not match:
+            return []
+        rank = f"bm25(paper_text, {', '.join(map(str, _BM25_WEIGHTS))})"
+        with connect(self.path, rows=True, foreign_keys=True) as db:
+            rows = db.execute("SELECT arxiv_id, title, snippet(paper_text, 2, '*', '*', '…', ?) AS snippet "
+                              f'FROM paper_text WHERE paper_text MATCH ? ORDER BY {rank} LIMIT ?',
+                              (snippet_tokens, match, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+    def set_zotero_uploaded(self, arxiv_id: str) -> None:
+        """
+        Record that the PDF of a paper is stored in Zotero.
+
+        Args:
+            arxiv_id: arXiv ID of the paper
+        """
+        with connect(self.path, rows=True, foreign_keys=True) as db:
+            db.execute('UPDATE papers SET zotero_uploaded_at = ?, updated_at = ? WHERE arxiv_id = ?',
+                       (time.time(), time.time(), arxiv_id))
+
+    def migrate_sidecars(self, dir_path: Path) -> int:
+        """
+        Import the legacy ``{paperID}_info.txt`` files of a directory, once.
+
+        Args:
+            dir_path: directory the papers were downloaded to
+
+        Returns:
+            Number of papers imported (0 if the directory was migrated before)
+        """
+        with connect(self.path, rows=True, foreign_keys=True) as db:
+            if db.execute("SELECT 1 FROM meta WHERE key = 'sidecars_migrated'").fetchone():
+                return 0
+
+        imported = 0
+        for info_file in sorted(Path(dir_path).glob('*_info.txt')):
+            arxiv_id = info_file.name[:-len('_info.txt')]
+            match = _SIDECAR.match(info_file.read_text(encoding='utf-8'))
+            if match is None:
+                logger.warning(f"Skipping unreadable paper info file {info_file}")
+                continue
+            authors = [name.strip() for name in match['authors'].split(',') if name.strip()]
+            self.save_metadata(arxiv_id, match['title'], authors, match['url'], match['summary'])
+            pdf_file = Path(dir_path) / f"{arxiv_id}.pdf"
+            if pdf_file.exists():
+                self.set_state(arxiv_id, STATE_DOWNLOADED, str(pdf_file))
+            imported += 1
+
+        with connect(self.path, rows=True, foreign_keys=True) as db:
+            db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('sidecars_migrated', ?)", (str(time.time()),))
+        logger.info(f"Imported {imported} paper info files from {dir_path} into the catalog")
+        return imported
+
+
+def _prefix_range(text: str) -> Tuple[str, str]:
+    """
+    Bounds of the strings starting with ``text``, for a range lookup on an index.
+    (LIKE with ESCAPE can't use the index.) Compared with the NOCASE collation of the
+    column, so the lookup ignores ASCII case like LIKE does.
+    """
+    return text, text + '\U0010ffff'
+
+
+def format_paper_info(record: Dict[str, Any]) -> str:
+    """
+    Describe a paper for a telegram reply.
+
+    Args:
+        record: paper as returned by the catalog
+
+    Returns:
+        Title, url, authors and summary, one per line
+    """
+    return (f"title, {record['title']}\n"
+            f"url, {record['url']}\n"
+            f"author, {', '.join(record['authors'])}\n"
+            f"summary, {record['summary']}")
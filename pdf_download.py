@@ -0,0 +1,136 @@
+import os
+import time
+import logging
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import requests
+from requests.exceptions import RequestException
+
+from http_session import get_session
+
+logger = logging.getLogger(__name__)
+
+PDF_MAGIC = b'%PDF-'
+
+
+class DownloadError(Exception):
+    """A file could not be downloaded completely and intact."""
+
+
+def is_pdf(path: Path) -> bool:
+    """
+    Check that a file starts with the PDF header.
+
+    Args:
+        path: file to check
+
+    Returns:
+        True if the file exists and looks like a PDF
+    """
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(PDF_MAGIC)) == PDF_MAGIC
+    except OSError:
+        return False
+
+
+def _expected_size(response: requests.Response, offset: int) -> Optional[int]:
+    """Full size of the file from Content-Range or Content-Length, None if unknown."""
+    content_range = response.headers.get('Content-Range')
+    if content_range and '/' in content_range:
+        total = content_range.rsplit('/', 1)[1]
+        if total.isdigit():
+            return int(total)
+    length = response.headers.get('Content-Length')
+    if length and length.isdigit() and 'gzip' not in response.headers.get('Content-Encoding', ''):
+        return offset + int(length)
+    return None
+
+
+def download_pdf(url: str, dest: Path, session: Optional[requests.Session] = None,
+                 chunk_size: int = 256 * 1024, max_attempts: int = 5, backoff: float = 2.0) -> Dict[str, Any]:
+    """
+    Download a PDF to ``dest`` without ever leaving a partial file there.
+
+    The data is streamed in chunks to ``<dest>.part``. A failed attempt is resumed with
+    an HTTP Range request where the previous one stopped. Once the size matches and the
+    file starts with the PDF header it is atomically renamed to ``dest``.
+
+    Args:
+        url: url of the PDF
+        dest: final path of the file
+        session: session to download with (defaults to the pooled session of the process)
+        chunk_size: bytes read and written at a time
+        max_attempts: attempts before giving up
+        backoff: seconds to wait after the first failed attempt, doubled after each one
+
+    Returns:
+        Dict with 'path', 'bytes', 'seconds', 'bytes_per_second' and 'resumed' (bytes
+        that didn't have to be downloaded again)
+
+    Raises:
+        DownloadError: if the PDF could not be downloaded intact
+    """
+    session = session or get_session()
+    dest = Path(dest)
+    part = dest.with_name(dest.name + '.part')
+    start = time.monotonic()
+    received = 0
+    resumed = part.stat().st_size if part.exists() else 0
+    last_error = None
+
+    for attempt in range(1, max_attempts + 1):
+        if attempt > 1:
+            time.sleep(backoff * 2 ** (attempt - 2))
+
+        offset = part.stat().st_size if part.exists() else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+        try:
+            with session.get(url, headers=headers, stream=True) as response:
+                if response.status_code == 416:
+                    # nothing left to fetch, or a stale part file: verify below
+                    expected = offset
+                else:
+                    response.raise_for_status()
+                    if offset and response.status_code != 206:
+                        # the server ignored the range, start over
+                        offset = 0
+                    expected = _expected_size(response, offset)
+                    with open(part, 'ab' if offset else 'wb') as f:
+                        for chunk in response.iter_content(chunk_size=chunk_size):
+                            f.write(chunk)
+                            received += len(chunk)
+        except (RequestException, OSError) as e:
+            last_error = e
+            logger.warning(f"Download of {url} interrupted (attempt {attempt}/{max_attempts}): {e}")
+            continue
+
+        size = part.stat().st_size
+        if expected is not None and size != expected:
+            last_error = DownloadError(f"got {size} of {expected} bytes")
+            logger.warning(f"Download of {url} incomplete (attempt {attempt}/{max_attempts}): {last_error}")
+            if size > expected:
+                part.unlink()
+            continue
+
+        if not is_pdf(part):
+            part.unlink()
+            last_error = DownloadError("downloaded file is not a PDF")
+            logger.warning(f"Download of {url} is not a PDF (attempt {attempt}/{max_attempts})")
+            continue
+
+        os.replace(part, dest)
+        seconds = time.monotonic() - start
+        stats = {
+            'path': str(dest),
+            'bytes': size,
+            'seconds': seconds,
+            'bytes_per_second': received / seconds if seconds > 0 else 0.0,
+            'resumed': resumed,
+        }
+        logger.info(f"Downloaded {dest.name}: {size} bytes in {seconds:.1f}s "
+                    f"({stats['bytes_per_second'] / 1e6:.2f} MB/s)")
+        return stats
+
+    raise DownloadError(f"Could not download {url} after {max_attempts} attempts: {last_error}")
@@ -0,0 +1,63 @@
+import logging
+from pathlib import Path
+from typing import List
+
+from pypdf import PdfReader
+
+logger = logging.getLogger(__name__)
+
+
+def extract_pages(path: Path) -> List[str]:
+    """
+    Extract the text of every page of a PDF.
+
+    A page whose text can't be extracted is logged and left empty, so one broken page
+    doesn't lose the rest of the paper.
+
+    Args:
+        path: PDF file
+
+    Returns:
+        Text of each page, in order
+    """
+    reader = PdfReader(str(path))
+    pages = []
+    for number, page in enumerate(reader.pages, start=1):
+        try:
+            pages.append(page.extract_text() or '')
+        except Exception as e:
+            logger.warning(f"Could not extract page {number} of {path}: {e}")
+            pages.append('')
+    return pages
+
+
+def extract_text(path: Path) -> str:
+    """
+    Extract the text of a PDF.
+
+    Args:
+        path: PDF file
+
+    Returns:
+        Text of all pages separated by blank lines
+    """
+    return '\n\n'.join(page for page in extract_pages(path) if page)
+
+
+def chunk_text(text: str, chunk_words: int = 200, overlap_words: int = 40) -> List[str]:
+    """
+    Split text into chunks of about ``chunk_words`` words, each repeating the last
+    ``overlap_words`` words of the previous one so no passage is cut in half.
+
+    Args:
+        text: text to split
+        chunk_words: words per chunk
+        overlap_words: words shared by consecutive chunks
+
+    Returns:
+        List of chunks, empty for a text without words
+    """
+    words = text.split()
+    step = max(1, chunk_words - overlap_words)
+    return [' '.join(words[start:start + chunk_words])
+            for start in range(0, max(len(words) - overlap_words, 1), step) if words[start:start + chunk_words]]
@@ -0,0 +1,61 @@
+import zlib
+import logging
+
+import msgpack
+from kombu.serialization import register
+
+logger = logging.getLogger(__name__)
+
+# name and content type of the serializer in celery's result_serializer setting
+SERIALIZER_NAME = 'zmsgpack'
+CONTENT_TYPE = 'application/x-zmsgpack'
+
+# first byte of a payload: plain or zlib compressed msgpack
+_PLAIN = b'\x00'
+_ZLIB = b'\x01'
+
+
+def dumps(obj, threshold: int = 1024) -> bytes:
+    """
+    Serialize with msgpack, compressing payloads larger than ``threshold`` bytes.
+
+    Args:
+        obj: object to serialize
+        threshold: payloads up to this size are stored uncompressed
+
+    Returns:
+        Serialized payload
+    """
+    payload = msgpack.packb(obj, use_bin_type=True)
+    if len(payload) > threshold:
+        return _ZLIB + zlib.compress(payload)
+    return _PLAIN + payload
+
+
+def loads(data: bytes):
+    """
+    Deserialize a payload produced by ``dumps``.
+
+    Args:
+        data: serialized payload
+
+    Returns:
+        The deserialized object
+    """
+    if isinstance(data, str):
+        data = data.encode('latin-1')
+    marker, payload = data[:1], data[1:]
+    if marker == _ZLIB:
+        payload = zlib.decompress(payload)
+    return msgpack.unpackb(payload, raw=False)
+
+
+def register_result_codec(threshold: int = 1024) -> None:
+    """
+    Register the serializer with kombu, so celery can use it as result_serializer.
+
+    Args:
+        threshold: results up to this many bytes are stored uncompressed
+    """
+    register(SERIALIZER_NAME, lambda obj: dumps(obj, threshold), loads,
+             content_type=CONTENT_TYPE, content_encoding='binary')
@@ -0,0 +1,35 @@
+import sqlite3
+from contextlib import contextmanager
+from typing import Iterator
+
+# seconds a connection waits for a lock held by another connection
+BUSY_TIMEOUT = 30
+
+
+@contextmanager
+def connect(path: str, rows: bool = False, foreign_keys: bool = False) -> Iterator[sqlite3.Connection]:
+    """
+    Open a connection that commits on success, rolls back on an error and is closed
+    afterwards.
+
+    The SQLite stores open one connection per call instead of keeping one, so they can
+    be used from several threads and processes (the bot and the workers) at once.
+
+    Args:
+        path: SQLite database file
+        rows: return rows as sqlite3.Row, readable by column name
+        foreign_keys: enforce foreign key constraints
+
+    Yields:
+        sqlite3.Connection
+    """
+    db = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+    if rows:
+        db.row_factory = sqlite3.Row
+    if foreign_keys:
+        db.execute('PRAGMA foreign_keys = ON')
+    try:
+        with db:
+            yield db
+    finally:
+        db.close()
@@ -0,0 +1,173 @@
+import fakeredis
+import pytest
+
+import conversation_store
+from conversation_store import InMemoryConversationStore, RedisConversationStore, create_conversation_store
+
+
+class FakeClock:
+    """Stands in for time.monotonic, advanced by the tests."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(conversation_store.time, 'monotonic', clock)
+    return clock
+
+
+def test_memory_store_get_set_delete():
+    store = InMemoryConversationStore()
+    assert store.get(1) is None
+    store.set(1, {'messages': [{'role': 'user', 'content': 'hi'}]})
+    assert store.get(1) == {'messages': [{'role': 'user', 'content': 'hi'}]}
+    store.delete(1)
+    assert store.get(1) is None
+    store.delete(1)
+
+
+def test_memory_store_evicts_least_recently_used():
+    store = InMemoryConversationStore(max_users=2)
+    store.set(1, {'n': 1})
+    store.set(2, {'n': 2})
+    # reading user 1 makes user 2 the least recently used
+    assert store.get(1) == {'n': 1}
+    store.set(3, {'n': 3})
+    assert len(store) == 2
+    assert store.get(2) is None
+    assert store.get(1) == {'n': 1}
+    assert store.get(3) == {'n': 3}
+
+
+def test_memory_store_expires_records(clock):
+    store = InMemoryConversationStore(ttl=60)
+    store.set(1, {'n': 1})
+    clock.now += 59
+    assert store.get(1) == {'n': 1}
+    clock.now += 1
+    assert store.get(1) is None
+    assert len(store) == 0
+
+
+def test_memory_store_set_restarts_ttl(clock):
+    store = InMemoryConversationStore(ttl=60)
+    store.set(1, {'n': 1})
+    clock.now += 50
+    store.set(1, {'n': 2})
+    clock.now += 50
+    assert store.get(1) == {'n': 2}
+
+
+def test_memory_store_evicts_expired_records_on_set(clock):
+    store = InMemoryConversationStore(max_users=10, ttl=60)
+    store.set(1, {'n': 1})
+    clock.now += 60
+    store.set(2, {'n': 2})
+    assert len(store) == 1
+
+
+def test_memory_store_without_ttl_keeps_records(clock):
+    store = InMemoryConversationStore()
+    store.set(1, {'n': 1})
+    clock.now += 10 ** 9
+    assert store.get(1) == {'n': 1}
+
+
+@pytest.fixture
+def redis_client():
+    return fakeredis.FakeRedis()
+
+
+def test_redis_store_get_set_delete(redis_client):
+    store = RedisConversationStore('redis://unused', redis_client=redis_client)
+    assert store.get(1) is None
+    store.set(1, {'messages': [{'role': 'assistant', 'content': 'héllo'}], 'summary': None})
+    assert store.get(1) == {'messages': [{'role': 'assistant', 'content': 'héllo'}], 'summary': None}
+    store.delete(1)
+    assert store.get(1) is None
+
+
+def test_redis_store_is_shared_between_instances(redis_client):
+    RedisConversationStore('redis://unused', redis_client=redis_client).set(7, {'n': 7})
+    assert RedisConversationStore('redis://unused', redis_client=redis_client).get(7) == {'n': 7}
+
+
+def test_redis_store_uses_prefixed_keys(redis_client):
+    store = RedisConversationStore('redis://unused', prefix='test:', redis_client=redis_client)
+    store.set(1, {'n': 1})
+    assert redis_client.keys('*') == [b'test:1']
+
+
+def test_redis_store_sets_ttl(redis_client):
+    store = RedisConversationStore('redis://unused', ttl=100, redis_client=redis_client)
+    store.set(1, {'n': 1})
+    assert 0 < redis_client.ttl(store._key(1)) <= 100
+
+
+def test_redis_store_set_refreshes_ttl(redis_client):
+    store = RedisConversationStore('redis://unused', ttl=100, redis_client=redis_client)
+    store.set(1, {'n': 1})
+    redis_client.expire(store._key(1), 5)
+    store.set(1, {'n': 2})
+    assert redis_client.ttl(store._key(1)) > 5
+    assert store.get(1) == {'n': 2}
+
+
+def test_redis_store_without_ttl_never_expires(redis_client):
+    store = RedisConversationStore('redis://unused', redis_client=redis_client)
+    store.set(1, {'n': 1})
+    assert redis_client.ttl(store._key(1)) == -1
+
+
+def test_memory_store_keeps_replies_apart_from_the_record():
+    store = InMemoryConversationStore()
+    store.set(1, {'turns': []})
+    store.add_reply(1, 'task-a', 'hello')
+    store.add_reply(1, 'task-b', 'again')
+    assert store.get(1) == {'turns': []}
+    assert store.get_replies(1) == {'task-a': 'hello', 'task-b': 'again'}
+    store.delete_replies(1, ['task-a'])
+    assert store.get_replies(1) == {'task-b': 'again'}
+
+
+def test_memory_store_drops_replies_of_evicted_users():
+    store = InMemoryConversationStore(max_users=1)
+    store.add_reply(1, 'task-a', 'no record yet')
+    assert store.get_replies(1) == {}
+    store.set(1, {'n': 1})
+    store.add_reply(1, 'task-a', 'hello')
+    store.set(2, {'n': 2})
+    assert store.get_replies(1) == {}
+
+
+def test_redis_store_keeps_replies_apart_from_the_record(redis_client):
+    store = RedisConversationStore('redis://unused', ttl=100, redis_client=redis_client)
+    store.set(1, {'turns': []})
+    store.add_reply(1, 'task-a', 'héllo')
+    store.add_reply(1, 'task-b', 'again')
+    assert store.get(1) == {'turns': []}
+    assert store.get_replies(1) == {'task-a': 'héllo', 'task-b': 'again'}
+    assert 0 < redis_client.ttl(store._replies_key(1)) <= 100
+    store.delete_replies(1, ['task-a'])
+    assert store.get_replies(1) == {'task-b': 'again'}
+    store.delete(1)
+    assert store.get_replies(1) == {}
+
+
+def test_create_conversation_store_from_environment(monkeypatch):
+    monkeypatch.setenv('CONVERSATION_STORE', 'memory')
+    monkeypatch.setenv('CONVERSATION_MAX_USERS', '5')
+    monkeypatch.setenv('CONVERSATION_TTL', '30')
+    store = create_conversation_store()
+    assert isinstance(store, InMemoryConversationStore)
+    assert store.max_users == 5 and store.ttl == 30
+
+    monkeypatch.setenv('CONVERSATION_STORE', 'sqlite')
+    with pytest.raises(ValueError):
+        create_conversation_store()
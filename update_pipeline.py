@@ -0,0 +1,121 @@
+import asyncio
+import functools
+import logging
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def update_chat_id(update: Any) -> Optional[int]:
+    """
+    Get the chat an update belongs to.
+
+    Args:
+        update: telebot.types.Update
+
+    Returns:
+        The chat id, or None for updates that are not tied to a chat
+    """
+    for attr in ('message', 'edited_message', 'channel_post', 'edited_channel_post'):
+        message = getattr(update, attr, None)
+        if message is not None:
+            return message.chat.id
+
+    callback_query = getattr(update, 'callback_query', None)
+    if callback_query is not None and callback_query.message is not None:
+        return callback_query.message.chat.id
+    return None
+
+
+class UpdatePipeline:
+    """
+    Bounded, per-chat ordered dispatch of telegram updates.
+
+    Updates of different chats are handled concurrently, updates of the same chat
+    are handled one after the other in arrival order. Once ``max_in_flight`` updates
+    are queued or running, ``submit`` waits until one of them is done, which pushes
+    back on the update source instead of growing memory.
+
+    The pipeline must be created inside the running event loop.
+    """
+
+    def __init__(self, handler: Callable[[Any], None], max_in_flight: int = 64, executor=None):
+        """
+        Args:
+            handler: blocking callable handling a single update, run in ``executor``
+            max_in_flight: maximum number of updates queued or running at once
+            executor: concurrent.futures executor for the handler (None = loop default)
+        """
+        self.handler = handler
+        self.max_in_flight = max_in_flight
+        self.executor = executor
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._chats: Dict[Optional[int], asyncio.Queue] = {}
+        self._workers = set()
+
+    async def submit(self, update: Any) -> None:
+        """
+        Queue an update, waiting for a free slot if the pipeline is full.
+
+        Args:
+            update: telebot.types.Update
+        """
+        await self._slots.acquire()
+
+        chat_id = update_chat_id(update)
+        queue = self._chats.get(chat_id)
+        if queue is None:
+            queue = self._chats[chat_id] = asyncio.Queue()
+            worker = asyncio.ensure_future(self._drain(chat_id, queue))
+            self._workers.add(worker)
+            worker.add_done_callback(self._workers.discard)
+        queue.put_nowait(update)
+
+    async def join(self) -> None:
+        """Wait until every submitted update has been handled."""
+        while self._workers:
+            await asyncio.gather(*list(self._workers))
+
+    async def _drain(self, chat_id: Optional[int], queue: asyncio.Queue) -> None:
+        """Handle the updates of one chat in order, exit once its queue is empty."""
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                update = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                # nothing can be queued between the check and the removal, no await in between
+                del self._chats[chat_id]
+                return
+
+            try:
+                await loop.run_in_executor(self.executor, self.handler, update)
+            except Exception as e:
+                logger.error(f"Error handling update {update.update_id} of chat {chat_id}: {e}")
+            finally:
+                self._slots.release()
+
+
+async def poll_updates(bot: Any, pipeline: UpdatePipeline, timeout: int = 20, retry_delay: int = 5) -> None:
+    """
+    Long poll telegram for updates and push them into the pipeline.
+
+    Args:
+        bot: telebot.TeleBot used to fetch the updates
+        pipeline: pipeline the updates are submitted to
+        timeout: long polling timeout in seconds
+        retry_delay: seconds to wait after a failed getUpdates call
+    """
+    loop = asyncio.get_event_loop()
+    offset = None
+    while True:
+        try:
+            updates = await loop.run_in_executor(None, functools.partial(
+                bot.get_updates, offset=offset, timeout=timeout, long_polling_timeout=timeout))
+        except Exception as e:
+            logger.error(f"Error polling telegram updates: {e}")
+            await asyncio.sleep(retry_delay)
+            continue
+
+        for update in updates:
+            offset = update.update_id + 1
+            await pipeline.submit(update)
@@ -0,0 +1,127 @@
+import os
+import fcntl
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+
+from sqlite_util import connect
+
+logger = logging.getLogger(__name__)
+
+
+class VectorIndex:
+    """
+    Chunks of the downloaded papers and their embeddings, searched by cosine similarity.
+
+    The vectors are rows of a raw float32 file that is memory-mapped for searching, so
+    the index is shared by all worker processes through the page cache instead of being
+    loaded into every one of them. Chunk texts live in SQLite; the number of chunk rows
+    is the number of valid vectors, so a writer that dies half way never corrupts it.
+    """
+
+    def __init__(self, path: str, name: str, dim: int):
+        """
+        Args:
+            path: directory of the index
+            name: name of the embedder of the vectors
+            dim: dimensions of the vectors
+
+        Raises:
+            ValueError: if the index was built by another embedder
+        """
+        self.dir = Path(path)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.vectors_file = self.dir / 'vectors.f32'
+        self.db_file = self.dir / 'chunks.sqlite3'
+        self.lock_file = self.dir / 'write.lock'
+        self.dim = dim
+        self._mapped = None
+        self._mapped_rows = 0
+        self._map_lock = threading.Lock()
+
+        with connect(self.db_file) as db:
+            db.execute('CREATE TABLE IF NOT EXISTS chunks '
+                       '(row INTEGER PRIMARY KEY, arxiv_id TEXT NOT NULL, position INTEGER NOT NULL, text TEXT NOT NULL)')
+            db.execute('CREATE INDEX IF NOT EXISTS chunks_arxiv_id ON chunks (arxiv_id)')
+            db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('embedder', ?), ('dim', ?)", (name, str(dim)))
+            meta = dict(db.execute('SELECT key, value FROM meta').fetchall())
+        if meta['embedder'] != name or int(meta['dim']) != dim:
+            raise ValueError(f"Vector index {path} was built with {meta['embedder']} ({meta['dim']} dimensions), "
+                             f"not {name} ({dim}); remove it to rebuild")
+
+    def __len__(self) -> int:
+        with connect(self.db_file) as db:
+            return db.execute('SELECT COUNT(*) FROM chunks').fetchone()[0]
+
+    def has_paper(self, arxiv_id: str) -> bool:
+        """True if the chunks of a paper are in the index."""
+        with connect(self.db_file) as db:
+            return db.execute('SELECT 1 FROM chunks WHERE arxiv_id = ? LIMIT 1', (arxiv_id,)).fetchone() is not None
+
+    def add_paper(self, arxiv_id: str, chunks: List[str], vectors: np.ndarray) -> None:
+        """
+        Append the chunks of a paper and their vectors.
+
+        Args:
+            arxiv_id: arXiv ID of the paper
+            chunks: chunk texts in order
+            vectors: (len(chunks), dim) unit length vectors
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if vectors.shape != (len(chunks), self.dim):
+            raise ValueError(f"Expected {len(chunks)} vectors of {self.dim} dimensions, got {vectors.shape}")
+
+        # one writer at a time across processes, readers are never blocked
+        with open(self.lock_file, 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            with connect(self.db_file) as db:
+                if db.execute('SELECT 1 FROM chunks WHERE arxiv_id = ? LIMIT 1', (arxiv_id,)).fetchone():
+                    return
+                rows = db.execute('SELECT COUNT(*) FROM chunks').fetchone()[0]
+                with open(self.vectors_file, 'ab') as f:
+                    # drop vectors of a writer that died before recording its chunks
+                    f.truncate(rows * self.dim * 4)
+                    f.write(vectors.tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+                db.executemany('INSERT INTO chunks (row, arxiv_id, position, text) VALUES (?, ?, ?, ?)',
+                               [(rows + position, arxiv_id, position, text) for position, text in enumerate(chunks)])
+        logger.info(f"Added {len(chunks)} chunks of {arxiv_id} to the vector index")
+
+    def _vectors(self, rows: int) -> np.ndarray:
+        """Memory map of the first ``rows`` vectors, remapped when the index grew."""
+        with self._map_lock:
+            if self._mapped is None or self._mapped_rows != rows:
+                self._mapped = np.memmap(self.vectors_file, dtype=np.float32, mode='r', shape=(rows, self.dim))
+                self._mapped_rows = rows
+            return self._mapped
+
+    def search(self, query: np.ndarray, k: int = 8) -> List[Dict[str, Any]]:
+        """
+        The chunks most similar to a query vector.
+
+        Args:
+            query: unit length query vector
+            k: number of chunks
+
+        Returns:
+            List of dicts with 'arxiv_id', 'position', 'text' and 'score', best first
+        """
+        rows = len(self)
+        if rows == 0:
+            return []
+        scores = self._vectors(rows) @ np.asarray(query, dtype=np.float32).reshape(self.dim)
+        k = min(k, rows)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        with connect(self.db_file) as db:
+            found = {row: (arxiv_id, position, text) for row, arxiv_id, position, text in db.execute(
+                f"SELECT row, arxiv_id, position, text FROM chunks WHERE row IN ({','.join('?' * len(top))})",
+                [int(row) for row in top])}
+        return [{'arxiv_id': found[row][0], 'position': found[row][1], 'text': found[row][2],
+                 'score': float(scores[row])} for row in (int(row) for row in top)]
@@ -0,0 +1,88 @@
+import asyncio
+import hmac
+import json
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from telebot.types import Update
+
+from update_pipeline import UpdatePipeline
+
+logger = logging.getLogger(__name__)
+
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookRequestHandler(BaseHTTPRequestHandler):
+    """
+    Accept telegram webhook POSTs and push the updates into the update pipeline.
+
+    Every request thread blocks until the pipeline has room for its update, so a
+    saturated bot answers telegram slower instead of queueing without bound.
+    """
+
+    def do_POST(self):
+        if self.path != self.server.webhook_path:
+            self.send_error(404)
+            return
+
+        token = self.headers.get(SECRET_TOKEN_HEADER, '')
+        if not hmac.compare_digest(token, self.server.secret_token):
+            logger.warning(f"Rejected webhook request from {self.client_address[0]}: bad secret token")
+            self.send_error(403)
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            payload = json.loads(self.rfile.read(length))
+            if not isinstance(payload, dict):
+                raise TypeError(f"expected an update object, got {type(payload).__name__}")
+            update = Update.de_json(payload)
+        except (ValueError, KeyError, TypeError) as e:
+            logger.error(f"Invalid webhook payload: {e}")
+            self.send_error(400)
+            return
+
+        future = asyncio.run_coroutine_threadsafe(self.server.pipeline.submit(update), self.server.loop)
+        future.result()
+
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.client_address[0]} - {format % args}")
+
+
+async def serve_webhook(pipeline: UpdatePipeline, host: str = '0.0.0.0', port: int = 8443,
+                        path: str = '/webhook', secret_token: Optional[str] = None) -> None:
+    """
+    Serve the telegram webhook until cancelled.
+
+    Args:
+        pipeline: pipeline the received updates are submitted to
+        host: interface to listen on
+        port: port to listen on
+        path: url path telegram posts the updates to
+        secret_token: expected X-Telegram-Bot-Api-Secret-Token header, required
+
+    Raises:
+        ValueError: if no secret token is given, the endpoint would accept updates from anyone
+    """
+    if not secret_token:
+        raise ValueError("a secret token is required to serve the telegram webhook")
+
+    server = ThreadingHTTPServer((host, port), WebhookRequestHandler)
+    server.daemon_threads = True
+    server.pipeline = pipeline
+    server.loop = asyncio.get_event_loop()
+    server.webhook_path = path
+    server.secret_token = secret_token
+
+    logger.info(f"Listening for telegram webhook on {host}:{port}{path}")
+    try:
+        await server.loop.run_in_executor(None, server.serve_forever)
+    finally:
+        server.shutdown()
+        server.server_close()
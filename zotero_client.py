@@ -1,27 +1,50 @@
 import os
+import re
+import copy
+import time
 import requests
-import hashlib
 import mimetypes
 import json
 import tempfile
 import logging
+import threading
 from typing import Optional, Dict, Any, List, BinaryIO, Tuple
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from http_session import get_session
+from file_upload import FileBody, file_hashes
 
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger('ZoteroClient')
 
+# items the Zotero API accepts in a single write request
+MAX_WRITE_ITEMS = 50
+# files authorized, uploaded and registered at the same time by upload_files
+UPLOAD_CONCURRENCY = int(os.getenv('ZOTERO_UPLOAD_CONCURRENCY', '4'))
+# item templates are the same for every library and rarely change
+TEMPLATE_TTL = int(os.getenv('ZOTERO_TEMPLATE_TTL', str(7 * 86400)))
+# on-disk cache of templates and collections, shared by the processes of a host
+CACHE_DIR = os.getenv('ZOTERO_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'zotero_client_cache')
+# objects per page of a multi-object request, the API maximum
+PAGE_SIZE = 100
+
+
+class WriteTokenUsedError(Exception):
+    """A write sent with a Zotero-Write-Token was already committed by an earlier request."""
+
+
 class ZoteroClient:
     """A comprehensive client for interacting with the Zotero API, with focus on file uploads."""
     
-    def __init__(self, api_key: str, library_type: str = 'user', library_id: str = None):
+    # templates fetched by any client of the process: (type and params) -> (fetched at, template)
+    _templates: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+    _templates_lock = threading.Lock()
+    
+    def __init__(self, api_key: str, library_type: str = 'user', library_id: str = None,
+                 session: Optional[requests.Session] = None, cache_dir: Optional[str] = CACHE_DIR,
+                 template_ttl: int = TEMPLATE_TTL):
         """
         Initialize the Zotero client.
         
@@ -29,7 +52,17 @@ class ZoteroClient:
             api_key: Your Zotero API key
             library_type: Type of library ('user' or 'group')
             library_id: ID of the library (userID for user libraries)
+            session: Optional session to send the requests with (defaults to the
+                pooled session of the current process)
+            cache_dir: Directory of the on-disk template and collection cache, None to
+                only cache in memory
+            template_ttl: Seconds an item template is reused
         """
+        self._session = session
+        self.cache_dir = cache_dir
+        self.template_ttl = template_ttl
+        self._collections: Optional[Dict[str, Any]] = None
+        self._collections_lock = threading.Lock()
         self.api_key = api_key
         self.library_type = library_type
         self.library_id = library_id
@@ -39,24 +72,78 @@ class ZoteroClient:
             'Authorization': f'Bearer {api_key}'
         }
 
+    @property
+    def session(self) -> requests.Session:
+        """Session the requests are sent with, keeping connections to the API alive."""
+        return self._session or get_session()
+
+    def _cache_path(self, name: str) -> Optional[str]:
+        """File of a cache entry, None if the on-disk cache is off."""
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, re.sub(r'[^\w.-]', '_', name) + '.json')
+
+    def _read_cache(self, name: str) -> Optional[Any]:
+        """Read an on-disk cache entry, None if it is missing or unreadable."""
+        path = self._cache_path(name)
+        if path is None or not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable cache file {path}: {e}")
+            return None
+
+    def _write_cache(self, name: str, value: Any) -> None:
+        """Write an on-disk cache entry atomically, so concurrent readers never see half of it."""
+        path = self._cache_path(name)
+        if path is None:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(value, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write cache file {path}: {e}")
+
     def get_template(self, item_type: str, **params) -> Dict[str, Any]:
         """
         Get an empty template for creating a new item.
         
+        Templates are cached in memory and on disk for ``template_ttl`` seconds, so only
+        the first item of a type costs a request.
+        
         Args:
             item_type: Type of item (e.g., 'attachment', 'document', 'journalArticle')
             **params: Additional parameters for the template (e.g., linkMode for attachments)
             
         Returns:
-            Dict containing the editable JSON template
+            Dict containing the editable JSON template, a copy the caller may modify
         """
         logger.debug(f"Getting template for type: {item_type}")
         logger.debug(f"Template params: {params}")
         
+        name = 'template_' + '_'.join([item_type] + [f'{key}-{params[key]}' for key in sorted(params)])
+        now = time.time()
+        with self._templates_lock:
+            cached = self._templates.get(name)
+        if cached is None:
+            entry = self._read_cache(name)
+            if entry is not None:
+                cached = (entry['fetched'], entry['template'])
+                with self._templates_lock:
+                    self._templates[name] = cached
+        if cached is not None and now - cached[0] < self.template_ttl:
+            logger.debug(f"Using cached template {name}")
+            return copy.deepcopy(cached[1])
+        
         endpoint = f"{self.base_url}/items/new"
         query_params = {'itemType': item_type, **params}
         
-        response = requests.get(endpoint, headers=self.headers, params=query_params)
+        response = self.session.get(endpoint, headers=self.headers, params=query_params)
         response.raise_for_status()
         
         # Extract the editable JSON from the data property
@@ -65,7 +152,10 @@ class ZoteroClient:
             template = template['data']
         
         logger.debug(f"Got template: {template}")
-        return template
+        with self._templates_lock:
+            self._templates[name] = (now, template)
+        self._write_cache(name, {'fetched': now, 'template': template})
+        return copy.deepcopy(template)
 
     def get_item(self, item_key: str) -> Dict[str, Any]:
         """
@@ -80,7 +170,7 @@ class ZoteroClient:
         logger.debug(f"Getting item with key: {item_key}")
         
         endpoint = f'{self.base_url}/{self.library_type}s/{self.library_id}/items/{item_key}'
-        response = requests.get(endpoint, headers=self.headers)
+        response = self.session.get(endpoint, headers=self.headers)
         response.raise_for_status()
         
         # Extract the editable JSON from the data property
@@ -91,13 +181,62 @@ class ZoteroClient:
         logger.debug(f"Got item: {result}")
         return result
 
-    def create_item(self, item_type: str, metadata: Dict[str, Any]) -> Dict[Any, Any]:
+    def create_items(self, items: List[Dict[str, Any]],
+                     write_token: Optional[str] = None) -> List[Optional[Dict[str, Any]]]:
+        """
+        Create many items with as few requests as possible, up to MAX_WRITE_ITEMS per POST.
+        
+        Args:
+            items: Filled in item templates
+            write_token: 32 character Zotero-Write-Token making a retried request
+                idempotent, only for up to MAX_WRITE_ITEMS items (one request)
+            
+        Returns:
+            List with the created item (editable JSON data) for every item in order,
+            None for the items Zotero rejected (the reason is logged)
+            
+        Raises:
+            WriteTokenUsedError: if a request with the same write token already created
+                the items (Zotero remembers tokens for 12 hours)
+        """
+        logger.debug(f"Creating {len(items)} items")
+        if write_token and len(items) > MAX_WRITE_ITEMS:
+            raise ValueError(f"A write token covers one request of up to {MAX_WRITE_ITEMS} items")
+        
+        endpoint = f'{self.base_url}/{self.library_type}s/{self.library_id}/items'
+        headers = {**self.headers, 'Content-Type': 'application/json'}
+        if write_token:
+            headers['Zotero-Write-Token'] = write_token
+        created = []
+        for start in range(0, len(items), MAX_WRITE_ITEMS):
+            batch = items[start:start + MAX_WRITE_ITEMS]
+            response = self.session.post(endpoint, headers=headers, json=batch)
+            if write_token and response.status_code == 412:
+                raise WriteTokenUsedError(f"Write token {write_token} was already used")
+            if response.status_code != 200:
+                logger.error(f"Error creating items. Status: {response.status_code}")
+                logger.error(f"Response: {response.text}")
+            response.raise_for_status()
+            
+            result = response.json()
+            if not isinstance(result, dict) or 'successful' not in result:
+                logger.error(f"Unexpected response format: {result}")
+                raise ValueError("Invalid response format from Zotero API")
+            for index, failure in result.get('failed', {}).items():
+                logger.error(f"Zotero rejected item {start + int(index)}: {failure.get('message')}")
+            created.extend(result['successful'].get(str(index), {}).get('data')
+                           for index in range(len(batch)))
+        return created
+
+    def create_item(self, item_type: str, metadata: Dict[str, Any],
+                    write_token: Optional[str] = None) -> Dict[Any, Any]:
         """
         Create a new item in Zotero by first getting an empty template and then submitting it.
         
         Args:
             item_type: Type of item (e.g., 'document', 'journalArticle')
             metadata: Dict containing item metadata
+            write_token: Optional Zotero-Write-Token, see create_items
             
         Returns:
             Dict containing the created item details (editable JSON data)
@@ -105,57 +244,16 @@ class ZoteroClient:
         logger.debug(f"Creating item of type: {item_type}")
         logger.debug(f"Metadata: {metadata}")
         
-        try:
-            # Get empty template from API
-            endpoint = f"{self.base_url}/items/new"
-            params = {'itemType': item_type}
-            
-            response = requests.get(endpoint, headers=self.headers, params=params)
-            response.raise_for_status()
-            
-            # Get the template data
-            template = response.json()
-            logger.debug(f"Got empty template: {template}")
-            
-            # Update template with metadata
-            template.update(metadata)
-            
-            # Submit the modified template in an array
-            create_endpoint = f'{self.base_url}/{self.library_type}s/{self.library_id}/items'
-            data = [template]  # Submit as array
-            logger.debug(f"Submitting data: {json.dumps(data, indent=2)}")
-            
-            create_response = requests.post(
-                create_endpoint,
-                headers={**self.headers, 'Content-Type': 'application/json'},
-                json=data  # Submit as array
-            )
-            
-            if create_response.status_code != 200:
-                logger.error(f"Error creating item. Status: {create_response.status_code}")
-                logger.error(f"Response: {create_response.text}")
-                
-            create_response.raise_for_status()
-            
-            # Extract the successful item data
-            result = create_response.json()
-            logger.debug(f"Create response: {json.dumps(result, indent=2)}")
-            
-            if isinstance(result, dict) and 'successful' in result:
-                # Get the first successful item's key and data
-                success_key = next(iter(result['successful']))
-                item_data = result['successful'][success_key]['data']
-                logger.debug(f"Created item: {json.dumps(item_data, indent=2)}")
-                return item_data
-            else:
-                logger.error(f"Unexpected response format: {result}")
-                raise ValueError("Invalid response format from Zotero API")
-            
-        except Exception as e:
-            logger.error(f"Failed to create item: {str(e)}")
-            raise
+        template = self.get_template(item_type)
+        template.update(metadata)
+        item = self.create_items([template], write_token)[0]
+        if item is None:
+            raise ValueError(f"Zotero rejected the {item_type} item")
+        logger.debug(f"Created item: {item.get('key')}")
+        return item
 
-    def create_attachment(self, parent_key: str, link_mode: str, metadata: Dict[str, Any]) -> Dict[Any, Any]:
+    def create_attachment(self, parent_key: str, link_mode: str, metadata: Dict[str, Any],
+                          write_token: Optional[str] = None) -> Dict[Any, Any]:
         """
         Create an attachment item by first getting an empty template and then submitting it.
         
@@ -163,6 +261,7 @@ class ZoteroClient:
             parent_key: Key of the parent item
             link_mode: One of 'imported_file', 'imported_url', 'linked_file', 'linked_url'
             metadata: Dict containing attachment metadata
+            write_token: Optional Zotero-Write-Token, see create_items
             
         Returns:
             Dict containing the created attachment details (editable JSON data)
@@ -171,64 +270,21 @@ class ZoteroClient:
         logger.debug(f"Link mode: {link_mode}")
         logger.debug(f"Metadata: {metadata}")
         
-        try:
-            # Get empty template from API
-            endpoint = f"{self.base_url}/items/new"
-            params = {
-                'itemType': 'attachment',
-                'linkMode': link_mode
-            }
-            
-            response = requests.get(endpoint, headers=self.headers, params=params)
-            response.raise_for_status()
-            
-            # Get the template data
-            template = response.json()
-            logger.debug(f"Got empty template: {template}")
-            
-            # Update template with required fields and metadata
-            template['parentItem'] = parent_key
-            template.update(metadata)
-            
-            # Submit the modified template in an array
-            create_endpoint = f'{self.base_url}/{self.library_type}s/{self.library_id}/items'
-            data = [template]  # Submit as array
-            logger.debug(f"Submitting data: {json.dumps(data, indent=2)}")
-            
-            create_response = requests.post(
-                create_endpoint,
-                headers={**self.headers, 'Content-Type': 'application/json'},
-                json=data  # Submit as array
-            )
-            
-            if create_response.status_code != 200:
-                logger.error(f"Error creating attachment. Status: {create_response.status_code}")
-                logger.error(f"Response: {create_response.text}")
-                
-            create_response.raise_for_status()
-            
-            # Extract the successful item data
-            result = create_response.json()
-            logger.debug(f"Create response: {json.dumps(result, indent=2)}")
-            
-            if isinstance(result, dict) and 'successful' in result:
-                # Get the first successful item's key and data
-                success_key = next(iter(result['successful']))
-                item_data = result['successful'][success_key]['data']
-                logger.debug(f"Created attachment: {json.dumps(item_data, indent=2)}")
-                return item_data
-            else:
-                logger.error(f"Unexpected response format: {result}")
-                raise ValueError("Invalid response format from Zotero API")
-            
-        except Exception as e:
-            logger.error(f"Failed to create attachment: {str(e)}")
-            raise
+        template = self.get_template('attachment', linkMode=link_mode)
+        template['parentItem'] = parent_key
+        template.update(metadata)
+        item = self.create_items([template], write_token)[0]
+        if item is None:
+            raise ValueError("Zotero rejected the attachment item")
+        logger.debug(f"Created attachment: {item.get('key')}")
+        return item
 
     def get_file_metadata(self, file_path: str) -> Dict[str, Any]:
         """
         Get metadata for a file including size, MD5 hash, and MIME type.
         
+        The file is hashed in chunks, and only again once its size or mtime changed.
+        
         Args:
             file_path: Path to the file
             
@@ -240,14 +296,12 @@ class ZoteroClient:
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"File not found: {file_path}")
             
-        with open(file_path, 'rb') as f:
-            content = f.read()
-            
+        hashes = file_hashes(file_path)
         metadata = {
             'filename': os.path.basename(file_path),
-            'filesize': len(content),
-            'md5': hashlib.md5(content).hexdigest(),
-            'mtime': int(os.path.getmtime(file_path) * 1000),  # Convert to milliseconds
+            'filesize': hashes['size'],
+            'md5': hashes['md5'],
+            'mtime': int(hashes['mtime'] * 1000),  # Convert to milliseconds
             'content_type': mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
         }
         
@@ -269,20 +323,13 @@ class ZoteroClient:
         logger.debug(f"Item key: {item_key}")
         logger.debug(f"File metadata: {file_metadata}")
         
-        # First, get the current item to check its version
-        item = self.get_item(item_key)
-        version = item.get('version')
-        
         endpoint = f'{self.base_url}/{self.library_type}s/{self.library_id}/items/{item_key}/file'
         headers = {
             **self.headers,
             'Content-Type': 'application/x-www-form-urlencoded',
-            #'If-Match': file_metadata['md5']  # Use current version for If-Match
-            'If-None-Match': '*'  # Use current version for If-Match
+            'If-None-Match': '*'  # the attachment has no file yet
         }
         
-        # Build form data string with proper URL encoding
-        from urllib.parse import urlencode
         form_data = {
             'md5': file_metadata['md5'],
             'filename': file_metadata['filename'],
@@ -293,76 +340,75 @@ class ZoteroClient:
         logger.debug(f"Request headers: {headers}")
         logger.debug(f"Request form data: {form_data}")
         
-        try:
-            #response = requests.post(endpoint, headers=headers, data=form_data)
-            response = requests.post(endpoint, headers=headers, data=form_data)
-            response.raise_for_status()
-            
-            result = response.json()
-            logger.debug(f"Got upload authorization: {result}")
-            
-            if result.get('exists') == 1:
-                logger.info("File already exists on server")
-                
-            return result
-            
-        except requests.exceptions.HTTPError as e:
-            logger.debug(e)
-            if e.response.status_code == 412:  # Precondition Failed
-                # Try again with If-None-Match for new files
-                headers['If-None-Match'] = '*'
-                del headers['If-Match']
-                
-                response = requests.post(endpoint, headers=headers, data=form_data)  # Use same form data format
-                response.raise_for_status()
-                
-                result = response.json()
-                logger.debug(f"Got upload authorization (retry): {result}")
-                return result
-            raise
+        response = self.session.post(endpoint, headers=headers, data=form_data)
+        if response.status_code == 412:
+            # The attachment already has a file: replace it, naming the current one
+            current_md5 = self.get_item(item_key).get('md5')
+            logger.debug(f"Attachment has a file already, replacing md5 {current_md5}")
+            del headers['If-None-Match']
+            headers['If-Match'] = current_md5
+            response = self.session.post(endpoint, headers=headers, data=form_data)
+        response.raise_for_status()
+        
+        result = response.json()
+        logger.debug(f"Got upload authorization: {result}")
+        if result.get('exists') == 1:
+            logger.info("File already exists on server")
+        elif 'If-Match' in headers:
+            # the upload must be registered with the same precondition
+            result['ifMatch'] = headers['If-Match']
+        return result
 
     def upload_to_s3(self, auth_data: Dict[str, Any], file_path: str) -> None:
         """
         Upload file to S3 using the authorization data.
         
+        The body is the multipart prefix from Zotero, the file streamed from disk and
+        the suffix, so the file is never held in memory.
+        
         Args:
             auth_data: Authorization data from get_upload_authorization
             file_path: Path to the file to upload
         """
         logger.debug(f"Uploading to S3: {file_path}")
-        logger.debug(f"Auth data: {auth_data}")
+        logger.debug(f"Upload url: {auth_data['url']}")
         
-        with open(file_path, 'rb') as f:
-            response = requests.post(
+        with FileBody(file_path, auth_data['prefix'].encode('utf-8'), auth_data['suffix'].encode('utf-8')) as body:
+            response = self.session.post(
                 auth_data['url'],
-                data=auth_data['params'],
-                files={'file': (os.path.basename(file_path), f, mimetypes.guess_type(file_path)[0])},
-                headers={'Content-Type': 'multipart/form-data'}
+                data=body,
+                headers={'Content-Type': auth_data['contentType']}
             )
         response.raise_for_status()
         logger.debug("S3 upload successful")
 
-    def register_upload(self, item_key: str, upload_key: str) -> Dict[Any, Any]:
+    def register_upload(self, item_key: str, upload_key: str, if_match: Optional[str] = None) -> Dict[Any, Any]:
         """
         Register the upload with Zotero.
         
         Args:
             item_key: Key of the item to attach the file to
             upload_key: Upload key from the authorization response
+            if_match: md5 of the replaced file, if the authorization replaced one
             
         Returns:
-            Dict containing the registration response (editable JSON data)
+            Dict containing the registration response (editable JSON data), empty when
+            Zotero answers 204 No Content
         """
         logger.debug(f"Registering upload for item: {item_key}")
         logger.debug(f"Upload key: {upload_key}")
         
         endpoint = f'{self.base_url}/{self.library_type}s/{self.library_id}/items/{item_key}/file'
-        response = requests.post(
+        precondition = {'If-Match': if_match} if if_match else {'If-None-Match': '*'}
+        response = self.session.post(
             endpoint,
-            headers={**self.headers, 'If-None-Match': '*'},
-            params={'upload': upload_key}
+            headers={**self.headers, 'Content-Type': 'application/x-www-form-urlencoded', **precondition},
+            data={'upload': upload_key}
         )
         response.raise_for_status()
+        if not response.content:
+            logger.debug("Upload registered")
+            return {}
         
         # Extract the editable JSON from the data property
         result = response.json()
@@ -372,6 +418,119 @@ class ZoteroClient:
         logger.debug(f"Upload registered: {result}")
         return result
 
+    def upload_attachment_file(self, attachment_key: str, file_path: str,
+                               file_metadata: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        Authorize, upload and register the file of an existing attachment item. Safe to
+        call again after a failure: a file Zotero already has isn't uploaded twice.
+        
+        Args:
+            attachment_key: Key of the attachment item
+            file_path: Path to the file to upload
+            file_metadata: Metadata from get_file_metadata, computed if not given
+        
+        Returns:
+            True if the file was uploaded, False if Zotero already had it
+        """
+        file_metadata = file_metadata or self.get_file_metadata(file_path)
+        auth = self.get_upload_authorization(attachment_key, file_metadata)
+        if auth.get('exists'):
+            logger.info(f"File already exists, no need to upload: {file_path}")
+            return False
+        self.upload_to_s3(auth, file_path)
+        self.register_upload(attachment_key, auth['uploadKey'], auth.get('ifMatch'))
+        return True
+
+    def upload_files(self, file_paths: List[str], collection: Optional[str] = None,
+                     parent_keys: Optional[List[Optional[str]]] = None, titles: Optional[List[Optional[str]]] = None,
+                     max_workers: int = UPLOAD_CONCURRENCY) -> List[Dict[str, Any]]:
+        """
+        Upload many files at once:
+        1. Hash the files concurrently
+        2. Create the missing parent items, then all attachment items, in batched POSTs
+           (one template request per item type)
+        3. Authorize, upload and register the files concurrently on a bounded pool
+        
+        A failure only affects its own file, the others are still uploaded.
+        
+        Args:
+            file_paths: Paths of the files to upload
+            collection: Optional key of the collection the new parent items are added to
+            parent_keys: Optional parent item key per file, None to create a 'document' parent
+            titles: Optional title per file (defaults to the filename)
+            max_workers: Files uploaded at the same time
+            
+        Returns:
+            One dict per file, in order, with 'file_path', 'parent_key', 'key' (of the
+            attachment), 'uploaded' (False if Zotero already had the file) and 'error'
+            (the exception, or None)
+        """
+        logger.debug(f"Starting upload of {len(file_paths)} files")
+        parent_keys = list(parent_keys or [None] * len(file_paths))
+        titles = list(titles or [None] * len(file_paths))
+        results = [{'file_path': path, 'parent_key': parent_key, 'key': None, 'uploaded': False, 'error': None}
+                   for path, parent_key in zip(file_paths, parent_keys)]
+        
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            def hash_file(path):
+                try:
+                    return self.get_file_metadata(path)
+                except Exception as e:
+                    return e
+            file_metadata = list(pool.map(hash_file, file_paths))
+            for result, metadata in zip(results, file_metadata):
+                if isinstance(metadata, Exception):
+                    result['error'] = metadata
+            
+            # parent items for the files without one
+            orphans = [i for i, result in enumerate(results) if not result['error'] and not result['parent_key']]
+            if orphans:
+                template = self.get_template('document')
+                parents = self.create_items([
+                    {**template,
+                     'title': titles[i] or os.path.splitext(file_metadata[i]['filename'])[0],
+                     'collections': [collection] if collection else []}
+                    for i in orphans
+                ])
+                for i, parent in zip(orphans, parents):
+                    if parent is None:
+                        results[i]['error'] = ValueError("Zotero rejected the parent item")
+                    else:
+                        results[i]['parent_key'] = parent['key']
+            
+            # attachment items
+            pending = [i for i, result in enumerate(results) if not result['error']]
+            if pending:
+                template = self.get_template('attachment', linkMode='imported_file')
+                attachments = self.create_items([
+                    {**template,
+                     'parentItem': results[i]['parent_key'],
+                     'title': titles[i] or file_metadata[i]['filename'],
+                     'contentType': file_metadata[i]['content_type'],
+                     'filename': file_metadata[i]['filename']}
+                    for i in pending
+                ])
+                for i, attachment in zip(pending, attachments):
+                    if attachment is None:
+                        results[i]['error'] = ValueError("Zotero rejected the attachment item")
+                    else:
+                        results[i]['key'] = attachment['key']
+            
+            # file uploads
+            uploads = {pool.submit(self.upload_attachment_file, results[i]['key'], file_paths[i],
+                                   file_metadata[i]): i
+                       for i, result in enumerate(results) if not result['error']}
+            for future, i in uploads.items():
+                try:
+                    results[i]['uploaded'] = future.result()
+                except Exception as e:
+                    logger.error(f"Upload of {file_paths[i]} failed: {e}")
+                    results[i]['error'] = e
+        
+        failed = sum(1 for result in results if result['error'])
+        logger.info(f"Uploaded {len(results) - failed} of {len(results)} files to Zotero")
+        return results
+
     def upload_file(self, file_path: str, collection: Optional[str] = None, parent_key: Optional[str] = None, title: Optional[str] = None) -> Dict[Any, Any]:
         """
         Upload a file to Zotero following the recommended API procedure:
@@ -386,49 +545,20 @@ class ZoteroClient:
             title: Optional title for the new item (defaults to filename)
             
         Returns:
-            Dict containing the upload response (editable JSON data)
+            Dict with 'file_path', 'parent_key', 'key' (of the attachment), 'uploaded'
+            (False if Zotero already had the file) and 'error' (None)
+
+        Raises:
+            Exception: the error of the failed step
         """
         logger.debug(f"Starting file upload: {file_path}")
         logger.debug(f"Parent key: {parent_key}")
         logger.debug(f"Title: {title}")
         
-        # Get file metadata
-        file_metadata = self.get_file_metadata(file_path)
-        
-        # Create parent item if none provided
-        if not parent_key:
-            parent = self.create_item('document', {
-                'title': title or os.path.splitext(file_metadata['filename'])[0],
-                'creators': [],
-                'collections': [collection]
-            })
-            parent_key = parent['key']
-        
-        # Create attachment item
-        attachment = self.create_attachment(
-            parent_key,
-            'imported_file',
-            {
-                'title': title or file_metadata['filename'],
-                'contentType': file_metadata['content_type'],
-                'filename': file_metadata['filename'],
-                'md5': ''
-            }
-        )
-        
-        # Get upload authorization
-        auth = self.get_upload_authorization(attachment['key'], file_metadata)
-        
-        # If file doesn't already exist, upload it
-        if not auth.get('exists'):
-            # Upload to S3
-            self.upload_to_s3(auth, file_path)
-            
-            # Register upload
-            return self.register_upload(attachment['key'], auth['uploadKey'])
-        else:
-            logger.info("File already exists, no need to upload")
-            return attachment
+        result = self.upload_files([file_path], collection, [parent_key], [title], max_workers=1)[0]
+        if result['error']:
+            raise result['error']
+        return result
 
     def upload_pdf(self, pdf_path: str, collection: Optional[str] = None, parent_key: Optional[str] = None, title: Optional[str] = None) -> Dict[Any, Any]:
         """
@@ -440,7 +570,11 @@ class ZoteroClient:
             title: Optional title for the new item
             
         Returns:
-            Dict containing the upload response (editable JSON data)
+            Result of upload_file: dict with 'file_path', 'parent_key', 'key' (of the
+            attachment), 'uploaded' (False if Zotero already had the file) and 'error' (None)
+
+        Raises:
+            ValueError: if the file isn't a PDF
         """
         logger.debug(f"Starting PDF upload: {pdf_path}")
         logger.debug(f"Parent key: {parent_key}")
@@ -451,22 +585,191 @@ class ZoteroClient:
         
         return self.upload_file(pdf_path, collection, parent_key, title)
 
+    def _get_pages(self, endpoint: str, params: Dict[str, Any],
+                   since_version: Optional[int] = None) -> Tuple[Optional[List[Any]], Optional[int]]:
+        """
+        Get all pages of a multi-object request.
+        
+        Args:
+            endpoint: Url of the objects
+            params: Query parameters
+            since_version: Library version the caller has, to get a 304 when nothing changed
+            
+        Returns:
+            (objects, Last-Modified-Version), objects is None if nothing changed
+        """
+        headers = dict(self.headers)
+        if since_version is not None:
+            headers['If-Modified-Since-Version'] = str(since_version)
+        objects, start = [], 0
+        while True:
+            response = self.session.get(endpoint, headers=headers,
+                                        params={**params, 'limit': PAGE_SIZE, 'start': start})
+            if response.status_code == 304:
+                return None, since_version
+            response.raise_for_status()
+            if start == 0:
+                version = int(response.headers.get('Last-Modified-Version', 0))
+                # later pages must come from the same library version
+                headers['If-Unmodified-Since-Version'] = str(version)
+                headers.pop('If-Modified-Since-Version', None)
+            page = response.json()
+            objects.extend(page)
+            start += len(page)
+            if not page or start >= int(response.headers.get('Total-Results', start)):
+                return objects, version
+
     def get_collections(self) -> List[Dict[str, Any]]:
         """
         Retrieve all collections from the Zotero library.
         
+        The collections are cached in memory and on disk with the library version they
+        were read at. Later calls only ask for the collections changed or deleted since
+        then, and get a 304 without a body when nothing changed.
+        
         Returns:
             List of dictionaries containing collection details
         """
         logger.debug("Retrieving all collections")
         
         endpoint = f'{self.base_url}/{self.library_type}s/{self.library_id}/collections'
-        response = requests.get(endpoint, headers=self.headers)
+        name = f'collections_{self.library_type}_{self.library_id}'
+        with self._collections_lock:
+            cache = self._collections or self._read_cache(name)
+            updated = True
+            if cache is None:
+                collections, version = self._get_pages(endpoint, {})
+                cache = {'version': version, 'collections': {c['key']: c for c in collections}}
+                logger.debug(f"Retrieved {len(collections)} collections at version {version}")
+            else:
+                changed, version = self._get_pages(endpoint, {'since': cache['version']}, cache['version'])
+                if changed is not None:
+                    deleted = self.get_deleted(cache['version']).get('collections', [])
+                    for collection in changed:
+                        cache['collections'][collection['key']] = collection
+                    for key in deleted:
+                        cache['collections'].pop(key, None)
+                    cache['version'] = version
+                    logger.debug(f"{len(changed)} collections changed and {len(deleted)} deleted, "
+                                 f"now at version {version}")
+                else:
+                    logger.debug(f"Collections unchanged since version {version}")
+                    updated = False
+            if updated:
+                self._write_cache(name, cache)
+            self._collections = cache
+            return list(cache['collections'].values())
+
+    def search_items(self, query: str, **params) -> List[Dict[str, Any]]:
+        """
+        Retrieve the items matching a quick search.
+        
+        Args:
+            query: Text to search for
+            **params: Additional query parameters (e.g., qmode='everything', itemType='journalArticle')
+            
+        Returns:
+            List of the items found (full API objects with 'key', 'version' and 'data')
+        """
+        logger.debug(f"Searching items for: {query}")
+        
+        endpoint = f'{self.base_url}/{self.library_type}s/{self.library_id}/items'
+        items, _ = self._get_pages(endpoint, {'q': query, **params})
+        return items
+
+    def get_children(self, item_key: str) -> List[Dict[str, Any]]:
+        """
+        Retrieve the child items (attachments and notes) of an item.
+        
+        Args:
+            item_key: Key of the parent item
+            
+        Returns:
+            List of the child items (full API objects with 'key', 'version' and 'data')
+        """
+        logger.debug(f"Retrieving children of item {item_key}")
+        
+        endpoint = f'{self.base_url}/{self.library_type}s/{self.library_id}/items/{item_key}/children'
+        children, _ = self._get_pages(endpoint, {})
+        return children
+
+    def get_versions(self, kind: str, since_version: int = 0) -> Tuple[Optional[Dict[str, int]], int]:
+        """
+        Retrieve the versions of the objects changed since a library version.
+        
+        Args:
+            kind: 'items' or 'collections'
+            since_version: Library version to compare with, 0 for all objects
+            
+        Returns:
+            ({key: version}, Last-Modified-Version), the dict is None if nothing changed
+        """
+        logger.debug(f"Retrieving {kind} versions since {since_version}")
+        
+        headers = dict(self.headers)
+        if since_version:
+            headers['If-Modified-Since-Version'] = str(since_version)
+        response = self.session.get(f'{self.base_url}/{self.library_type}s/{self.library_id}/{kind}',
+                                    headers=headers, params={'since': since_version, 'format': 'versions'})
+        version = int(response.headers.get('Last-Modified-Version', since_version))
+        if response.status_code == 304:
+            return None, version
         response.raise_for_status()
+        return response.json(), version
+
+    def get_objects_by_keys(self, kind: str, keys: List[str]) -> List[Dict[str, Any]]:
+        """
+        Retrieve items or collections by key, up to MAX_WRITE_ITEMS per request.
         
-        collections = response.json()
-        logger.debug(f"Retrieved {len(collections)} collections")
-        return collections
+        Args:
+            kind: 'items' or 'collections'
+            keys: Keys of the objects
+            
+        Returns:
+            List of the objects found (full API objects with 'key', 'version' and 'data')
+        """
+        logger.debug(f"Retrieving {len(keys)} {kind} by key")
+        
+        key_param = {'items': 'itemKey', 'collections': 'collectionKey'}[kind]
+        endpoint = f'{self.base_url}/{self.library_type}s/{self.library_id}/{kind}'
+        objects = []
+        for start in range(0, len(keys), MAX_WRITE_ITEMS):
+            batch = keys[start:start + MAX_WRITE_ITEMS]
+            response = self.session.get(endpoint, headers=self.headers,
+                                        params={key_param: ','.join(batch), 'limit': MAX_WRITE_ITEMS})
+            response.raise_for_status()
+            objects.extend(response.json())
+        return objects
+
+    def get_deleted(self, since_version: int) -> Dict[str, List[str]]:
+        """
+        Retrieve the keys of the objects deleted since a library version.
+        
+        Args:
+            since_version: Library version to compare with
+            
+        Returns:
+            Dict with the deleted 'collections', 'items', 'searches', 'tags' and 'settings'
+        """
+        logger.debug(f"Retrieving objects deleted since version {since_version}")
+        
+        response = self.session.get(f'{self.base_url}/{self.library_type}s/{self.library_id}/deleted',
+                                    headers=self.headers, params={'since': since_version})
+        response.raise_for_status()
+        return response.json()
+
+    def get_key_info(self) -> Dict[str, Any]:
+        """
+        Retrieve the privileges of the API key, a cheap way to check connectivity and credentials.
+        
+        Returns:
+            Dict containing the key details (userID, username, access)
+        """
+        logger.debug("Retrieving API key info")
+        
+        response = self.session.get(f'{self.base_url}/keys/current', headers=self.headers)
+        response.raise_for_status()
+        return response.json()
 
 def test_upload():
     api_key = os.getenv('ZOTERO_API_KEY')
@@ -501,6 +804,11 @@ def test_get_collection():
         logger.debug(collection)
 
 if __name__ == "__main__":
+    # Configure logging
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
     #test_get_collection()
     
     test_upload()
\ No newline at end of file
@@ -0,0 +1,145 @@
+import json
+import time
+import sqlite3
+import logging
+from typing import Any, Dict, List, Optional
+
+from sqlite_util import connect
+from zotero_client import ZoteroClient
+
+logger = logging.getLogger(__name__)
+
+# kinds of objects mirrored, collections first so items never refer to unknown ones
+_KINDS = ('collections', 'items')
+
+
+class ZoteroMirror:
+    """
+    Local SQLite copy of the items and collections of a Zotero library.
+
+    ``sync`` only downloads what changed since the library version of the previous
+    sync, so the mirror can be refreshed often. Lookups by url or file md5 then answer
+    "is this already in Zotero?" without an API request.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: SQLite database file
+        """
+        self.path = path
+        with connect(self.path, rows=True) as db:
+            db.execute('CREATE TABLE IF NOT EXISTS items (key TEXT PRIMARY KEY, version INTEGER NOT NULL, '
+                       'item_type TEXT, parent_key TEXT, title TEXT, url TEXT, md5 TEXT, data TEXT NOT NULL)')
+            db.execute('CREATE INDEX IF NOT EXISTS items_url ON items (url)')
+            db.execute('CREATE INDEX IF NOT EXISTS items_md5 ON items (md5)')
+            db.execute('CREATE INDEX IF NOT EXISTS items_parent_key ON items (parent_key)')
+            db.execute('CREATE TABLE IF NOT EXISTS collections (key TEXT PRIMARY KEY, version INTEGER NOT NULL, '
+                       'name TEXT, parent_key TEXT, data TEXT NOT NULL)')
+            db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+
+    @property
+    def library_version(self) -> int:
+        """Library version of the last sync, 0 before the first one."""
+        with connect(self.path, rows=True) as db:
+            row = db.execute("SELECT value FROM meta WHERE key = 'library_version'").fetchone()
+        return int(row['value']) if row else 0
+
+    def _save(self, db: sqlite3.Connection, kind: str, objects: List[Dict[str, Any]]) -> None:
+        for obj in objects:
+            data = obj.get('data', obj)
+            if kind == 'items':
+                db.execute('INSERT OR REPLACE INTO items (key, version, item_type, parent_key, title, url, md5, data) '
+                           'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                           (obj['key'], obj.get('version', data.get('version', 0)), data.get('itemType'),
+                            data.get('parentItem'), data.get('title'), data.get('url') or None,
+                            data.get('md5') or None, json.dumps(data)))
+            else:
+                db.execute('INSERT OR REPLACE INTO collections (key, version, name, parent_key, data) '
+                           'VALUES (?, ?, ?, ?, ?)',
+                           (obj['key'], obj.get('version', data.get('version', 0)), data.get('name'),
+                            data.get('parentCollection') or None, json.dumps(data)))
+
+    def save_items(self, items: List[Dict[str, Any]]) -> None:
+        """
+        Add items created by this application right away, before the next sync.
+
+        Args:
+            items: API objects (with 'key', 'version' and 'data') or item data
+        """
+        with connect(self.path, rows=True) as db:
+            self._save(db, 'items', items)
+
+    def sync(self, client: ZoteroClient) -> Dict[str, int]:
+        """
+        Bring the mirror up to date with the library.
+
+        Args:
+            client: client of the library
+
+        Returns:
+            Dict with the number of 'items' and 'collections' updated, the number of
+            objects 'deleted' and the new 'version'
+        """
+        start = time.monotonic()
+        since = self.library_version
+        stats = {'items': 0, 'collections': 0, 'deleted': 0, 'version': since}
+        changed = {}
+        library_versions = []
+        for kind in _KINDS:
+            versions, version = client.get_versions(kind, since)
+            library_versions.append(version)
+            if versions is None:
+                # nothing changed in the library, the other kinds can't have changed either
+                logger.debug(f"Zotero mirror is up to date at version {since}")
+                return stats
+            with connect(self.path, rows=True) as db:
+                local = dict(db.execute(f'SELECT key, version FROM {kind}').fetchall())
+            keys = [key for key, remote in versions.items() if local.get(key) != remote]
+            changed[kind] = client.get_objects_by_keys(kind, keys) if keys else []
+
+        # a change between the requests is fetched again by the next sync
+        version = min(library_versions)
+        deleted = client.get_deleted(since) if since else {}
+        with connect(self.path, rows=True) as db:
+            for kind in _KINDS:
+                self._save(db, kind, changed[kind])
+                stats[kind] = len(changed[kind])
+                keys = deleted.get(kind, [])
+                db.executemany(f'DELETE FROM {kind} WHERE key = ?', [(key,) for key in keys])
+                stats['deleted'] += len(keys)
+            db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('library_version', ?)", (str(version),))
+        stats['version'] = version
+        logger.info(f"Synced Zotero mirror to version {version} in {time.monotonic() - start:.1f}s: "
+                    f"{stats['items']} items, {stats['collections']} collections, {stats['deleted']} deleted")
+        return stats
+
+    def find_by_url(self, url: str) -> Optional[Dict[str, Any]]:
+        """
+        A regular (not attachment) item with this url.
+
+        Args:
+            url: url of the item
+
+        Returns:
+            Item data, or None if the library has no such item
+        """
+        with connect(self.path, rows=True) as db:
+            row = db.execute("SELECT key, data FROM items WHERE url = ? AND item_type NOT IN ('attachment', 'note') "
+                             'LIMIT 1', (url,)).fetchone()
+        return {**json.loads(row['data']), 'key': row['key']} if row else None
+
+    def find_by_md5(self, md5: str) -> Optional[Dict[str, Any]]:
+        """
+        An attachment whose file has this md5.
+
+        Args:
+            md5: md5 of the file
+
+        Returns:
+            Attachment data, or None if the library has no such file
+        """
+        with connect(self.path, rows=True) as db:
+            row = db.execute("SELECT key, data FROM items WHERE md5 = ? AND item_type = 'attachment' LIMIT 1",
+                             (md5,)).fetchone()
+        return {**json.loads(row['data']), 'key': row['key']} if row else None